@@ -1,11 +1,18 @@
-import pandas as pd
 import os.path
+import hashlib
 import numpy as np
 
 '''
 module to load instance for region: city, suburb or rural
+
+fetch_data compiles the excel data and travel matrix into an instance once
+and stores it as arrays in instance_cache/, keyed on the content hash of
+both source files, so later calls skip excel parsing and unpickling
+(pandas is only imported to compile the instance on a cache miss)
 '''
 
+CACHE_VERSION = 1
+
 
 def fetch_data(region):
 
@@ -16,6 +23,97 @@ def fetch_data(region):
     file_name = 'example_data'
     extension = '.xlsx'
     complete_path = os.path.join(save_path, file_name+extension)
+    matrix_name = 'travel_matrix_osmnx'
+    #matrix_name = 'travel_matrix'
+    matrix_path = os.path.join(save_path, matrix_name+'.txt')
+    cache_path = os.path.join(save_path, 'instance_cache')
+
+    key = cache_key(complete_path, matrix_path)
+    extract = load_compiled(key, cache_path)
+    if extract is None:
+        extract = compile_data(complete_path, matrix_name, save_path)
+        store_compiled(extract, key, cache_path)
+    return extract
+
+# ------------------------------------------------------------------------------
+# compiled instance cache
+# ------------------------------------------------------------------------------
+
+
+def cache_key(*paths):
+    h = hashlib.sha1(str(CACHE_VERSION).encode())
+    for path in paths:
+        with open(path, 'rb') as file:
+            h.update(hashlib.sha1(file.read()).digest())
+    return h.hexdigest()
+
+
+def store_compiled(extract, key, cache_path):
+    os.makedirs(cache_path, exist_ok=True)
+    n, v = extract['n'], extract['v']
+    tw = np.full((n, 2), np.nan)
+    tw[1:] = extract['tw'][1:]
+    shift_id = np.zeros(n-1, dtype=np.int64)
+    for k, r in enumerate(extract['route']):
+        shift_id[np.array(r, dtype=np.int64)-1] = k
+    arrival = extract['arrival']
+    arrival_len = [0 if a is None else len(a) for a in arrival]
+    arrival_flat = np.concatenate([a for a in arrival if a is not None] + [[]])
+    # write to a temporary file first so concurrent workers never read
+    # a partially written cache entry
+    tmp = os.path.join(cache_path, key + '.%d.tmp.npz' % os.getpid())
+    np.savez(tmp, n=n, v=v, p=extract['p'], d=extract['d'], tw=tw,
+             Q=extract['Q'], u=extract['u'], ss=extract['ss'],
+             shift_id=shift_id, arrival=arrival_flat, arrival_len=arrival_len,
+             scores=[extract['score'], extract['dist'], extract['wt'],
+                     extract['ot']])
+    os.replace(tmp, os.path.join(cache_path, key + '.npz'))
+
+
+def load_compiled(key, cache_path):
+    complete_name = os.path.join(cache_path, key + '.npz')
+    if not os.path.exists(complete_name):
+        return None
+    with np.load(complete_name) as data:
+        n, v = int(data['n']), int(data['v'])
+        shift_id = data['shift_id']
+        route = [(np.flatnonzero(shift_id == k)+1).tolist() for k in range(v)]
+        tw = data['tw'].tolist()
+        tw[0] = None
+        arrival = []
+        offsets = np.cumsum(np.concatenate(([0], data['arrival_len'])))
+        flat = data['arrival'].tolist()
+        for k in range(v):
+            a = flat[offsets[k]:offsets[k+1]]
+            arrival.append(a if len(a) > 0 else None)
+        score, dist, wt, ot = data['scores'].tolist()
+        extract = {
+            'n': n,
+            'v': v,
+            'p': data['p'].tolist(),
+            'd': data['d'].tolist(),
+            'tw': tw,
+            'Q': data['Q'],
+            'u': data['u'].tolist(),
+            'ss': data['ss'].tolist(),
+            'route': route,
+            'arrival': arrival,
+            'arrival_nobase': [[] if a is None else a[1:-1] for a in arrival],
+            'score': score,
+            'dist': dist,
+            'wt': wt,
+            'ot': ot
+        }
+    return extract
+
+# ------------------------------------------------------------------------------
+# compile instance from source files
+# ------------------------------------------------------------------------------
+
+
+def compile_data(complete_path, matrix_name, save_path):
+    import pandas as pd
+
     xfile = pd.ExcelFile(complete_path)
 
     activity_data = pd.read_excel(xfile, 'activity_data')
@@ -28,50 +126,32 @@ def fetch_data(region):
     n, v = activity_data.shape[0], shift_data.shape[0]
 
     # processing time per activity
-    p = [activity_data['duration'][i] for i in range(n)]
-    p.insert(0, 0)
+    p = [0] + activity_data['duration'].tolist()
 
     # travel time matrix
     from store_n_load import load
-    #d = load('travel_matrix', save_path)
-    d = load('travel_matrix_osmnx', save_path)
-
-    # shift duration
-    u = []
-    for k in range(v):
-        shift_start = shift_data['shift_start'][k]
-        shift_end = shift_data['shift_end'][k]
-        shift_duration = convert(shift_end)-convert(shift_start)
-        u.append(shift_duration)
+    d = load(matrix_name, save_path)
 
-    # shift start times
-    ss = []
-    for k in range(v):
-        shift_start = shift_data['shift_start'][k]
-        ss.append(convert(shift_start))
+    # shift start times and shift duration
+    ss = np.array([convert(t) for t in shift_data['shift_start']])
+    se = np.array([convert(t) for t in shift_data['shift_end']])
+    u = (se - ss).tolist()
+    ss = ss.tolist()
 
     # qualification matrix
-    activityQ = activity_data['activity_level']
-    shiftQ = shift_data['shift_level']
-    Q = np.zeros((n, v))
-    for i in range(n):
-        for k in range(v):
-            if activityQ[i] <= shiftQ[k]:
-                Q[i][k] = 1
+    activityQ = activity_data['activity_level'].to_numpy()
+    shiftQ = shift_data['shift_level'].to_numpy()
+    Q = (activityQ[:, None] <= shiftQ[None, :]).astype(float)
 
     # extract route from schedule
-    route = [[] for k in range(v)]
-    for i in range(n):
-        shiftnr = activity_data['shift_id'][i]
-        route[shiftnr].append(i+1)
+    shift_id = activity_data['shift_id'].to_numpy()
+    route = [(np.flatnonzero(shift_id == k)+1).tolist() for k in range(v)]
 
     # time windows
     # step 1: temporary set tw to shift start and end time
-    twtemp = [0 for i in range(n)]
-    for i in range(n):
-        shift_id = activity_data['shift_id'][i]
-        twtemp[i] = [ss[shift_id], ss[shift_id]+u[shift_id]]
-    twtemp.insert(0, None)
+    s = np.array(ss)[shift_id]
+    e = s + np.array(u)[shift_id]
+    twtemp = [None] + np.column_stack((s, e)).tolist()
 
     # step 2: interpolate time windows
     import instance
@@ -89,38 +169,21 @@ def fetch_data(region):
             arrival2.append([])
 
     # arrival time per activity: midpoint for tw
+    # (activity_id i is client i, i.e. row i-1 of activity_data)
     length = 60
-    mid = [0 for i in range(n)]
-    s = [0 for i in range(n)]
-    for activity_id in activity_data['activity_id']:
-        for r in route:
-            if activity_id in r:
-                shift_id = route.index(r)
-                activity_idx = r.index(activity_id)
-        mid[activity_id-1] = arrival2[shift_id][activity_idx]
-
-    # shift start time per activity
-    s = [0 for i in range(n)]
-    for i in range(n):
-        shift_id = activity_data['shift_id'][i]
-        s[i] = ss[shift_id]
+    mid = np.zeros(n)
+    for k in range(v):
+        mid[np.array(route[k], dtype=np.int64)-1] = arrival2[k]
 
     # step 3: compute time windows
-    start, end = [], []
-    for i in range(n):
-        left = min(length/2, mid[i]-s[i])
-        right = length-left
-        start.append(mid[i]-left)
-        end.append(mid[i]+right)
-    tw = [0 for i in range(n)]
-    for i in range(n):
-        tw_bool = activity_data['tw_bool'][i]
-        if tw_bool == 1:
-            tw[i] = [convert(activity_data['tw_start'][i]),
-                     convert(activity_data['tw_end'][i])]
-        else:
-            tw[i] = [start[i], end[i]]
-    tw.insert(0, None)
+    left = np.minimum(length/2, mid-s)
+    start = mid-left
+    end = mid+length-left
+    tw_bool = activity_data['tw_bool'].to_numpy() == 1
+    for i in np.flatnonzero(tw_bool):
+        start[i] = convert(activity_data['tw_start'][i])
+        end[i] = convert(activity_data['tw_end'][i])
+    tw = [None] + np.column_stack((start, end)).tolist()
 
     extract = {
         'n': n+1,  # +1 to include base
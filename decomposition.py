@@ -0,0 +1,270 @@
+import concurrent.futures
+import time
+import datetime
+import numpy as np
+import instance as ins_module
+import schedule
+import gomea
+
+"""
+module contains decomposition solver for large instances
+
+main function is decompose_solve:
+    partitions clients and shifts of instance into subproblems, solves the
+    sub-instances concurrently with gomea_solve and merges the partial plans
+    size (integer): target number of clients per partition
+    workers (integer or None): number of processes (None: number of cores)
+    passes (integer): maximum number of boundary improvement passes
+    remaining **params are passed to gomea_solve for every partition
+    returns dictionary like gomea_solve with partitions and their scores
+
+steps:
+    partition: balanced k-medoids on a client dissimilarity combining travel
+        time (d), time window midpoints (tw) and shared qualifications (Q),
+        every partition gets at least one shift and shift time in proportion
+        to its workload, the partition with the largest unmet share takes the
+        free shift its clients are best qualified for and overlap in time with
+    solve: one gomea_solve per partition in a process pool
+    merge: maps partial routes back to the client and shift ids of instance
+    repair: clients left without a qualified shift in their partition (or in
+        a partition too small to solve) are inserted at the cheapest position
+    improve: clients near a partition boundary are relocated to the best
+        position on the shifts of neighbouring partitions while it pays off
+"""
+
+# ------------------------------------------------------------------------------
+# partitioning
+# ------------------------------------------------------------------------------
+
+
+def dissimilarity(instance, wtime=1, wqual=1):
+    n = instance.n
+    D = np.asarray(instance.d, dtype=np.float64)[1:, 1:]
+    geo = (D + D.T)/2
+    geo /= max(geo.mean(), 1e-9)
+    tw = np.array(instance.tw[1:n], dtype=np.float64)
+    mid = tw.mean(axis=1)
+    tmp = np.abs(mid[:, None] - mid[None, :])/max(np.mean(instance.u), 1e-9)
+    Q = np.asarray(instance.Q)[:n-1] == 1
+    shared = Q.astype(np.float64) @ Q.T
+    union = Q.sum(axis=1)[:, None] + Q.sum(axis=1)[None, :] - shared
+    qual = 1 - shared/np.maximum(union, 1)
+    return geo + wtime*tmp + wqual*qual
+
+
+def partition_clients(dis, K, iterations=5):
+    N = dis.shape[0]
+    cap = int(np.ceil(N/K))
+    # farthest-first seeds
+    medoids = [int(np.argmax(dis.sum(axis=1)))]
+    while len(medoids) < K:
+        medoids.append(int(np.argmax(dis[:, medoids].min(axis=1))))
+    for it in range(iterations):
+        dm = dis[:, medoids]
+        best = np.sort(dm, axis=1)
+        regret = best[:, 1] - best[:, 0] if K > 1 else np.zeros(N)
+        label = np.full(N, -1)
+        load = np.zeros(K, dtype=np.int64)
+        for i in np.argsort(-regret, kind='stable'):
+            for c in np.argsort(dm[i], kind='stable'):
+                if load[c] < cap:
+                    label[i] = c
+                    load[c] += 1
+                    break
+        new = []
+        for c in range(K):
+            members = np.flatnonzero(label == c)
+            within = dis[np.ix_(members, members)].sum(axis=1)
+            new.append(int(members[np.argmin(within)]))
+        if new == medoids:
+            break
+        medoids = new
+    return label
+
+
+def partition_shifts(instance, label, K):
+    n, v = instance.n, instance.v
+    Q = np.asarray(instance.Q)[:n-1] == 1
+    tw = np.array(instance.tw[1:n], dtype=np.float64)
+    ss = np.asarray(instance.ss, dtype=np.float64)
+    se = ss + np.asarray(instance.u, dtype=np.float64)
+    p = np.asarray(instance.p, dtype=np.float64)[1:n]
+    # fraction of time window of client i within span of shift k, shifts
+    # without overlap still rank above shifts the partition is not qualified for
+    inside = np.minimum(tw[:, 1:2], se) - np.maximum(tw[:, 0:1], ss)
+    length = np.maximum(tw[:, 1] - tw[:, 0], 1e-9)[:, None]
+    fit = Q*(np.clip(inside/length, 0, 1) + 1e-3)
+    affinity = np.array([fit[label == c].mean(axis=0) for c in range(K)])
+    # shift time owed to each partition: its share of the workload
+    demand = np.array([p[label == c].sum() for c in range(K)])
+    demand = (se - ss).sum()*demand/max(demand.sum(), 1e-9)
+    owner = np.full(v, -1)
+
+    def take(c):
+        free = np.flatnonzero(owner == -1)
+        # best fitting free shift, longest on ties
+        k = free[np.lexsort((-(se - ss)[free], -affinity[c, free]))[0]]
+        owner[k] = c
+        demand[c] -= se[k] - ss[k]
+
+    # every partition gets one shift first (largest workload first), then
+    # the partition with the largest unmet share takes the next shift
+    for c in np.argsort(-demand, kind='stable'):
+        take(c)
+    for k in range(v - K):
+        take(int(np.argmax(demand)))
+    return owner
+
+
+def sub_instance(instance, clients, shifts):
+    idx = [0] + list(clients)
+    d = [[instance.d[i][j] for j in idx] for i in idx]
+    p = [instance.p[i] for i in idx]
+    tw = [instance.tw[i] for i in idx]
+    Q = np.asarray(instance.Q)[np.ix_(np.array(clients) - 1, shifts)]
+    u = [instance.u[k] for k in shifts]
+    ss = [instance.ss[k] for k in shifts]
+    return ins_module.Instance(len(idx), len(shifts), d, p, tw, Q, u, ss)
+
+
+def solve_part(sub, params, seed):
+    return gomea.gomea_solve(sub, seed=seed, **params)
+
+# ------------------------------------------------------------------------------
+# repair and improvement on merged plan
+# ------------------------------------------------------------------------------
+
+
+def shift_score(instance, r, k):
+    return schedule.r_score(r, k, instance.d, instance.p, instance.tw,
+                            instance.u, instance.ss)
+
+
+# returns (delta, position) of cheapest insertion of client i in shift k
+def best_insertion(instance, route, cost, i, k):
+    best = (np.inf, None)
+    r = route[k]
+    for pos in range(len(r) + 1):
+        delta = shift_score(instance, r[:pos] + [i] + r[pos:], k) - cost[k]
+        if delta < best[0]:
+            best = (delta, pos)
+    return best
+
+
+def repair(instance, route, cost, orphans):
+    Q = np.asarray(instance.Q)
+    for i in orphans:
+        options = [(best_insertion(instance, route, cost, i, k), k)
+                   for k in np.flatnonzero(Q[i-1] == 1)]
+        (delta, pos), k = min(options, key=lambda o: o[0][0])
+        route[k].insert(pos, i)
+        cost[k] += delta
+
+
+def improve(instance, route, cost, label, owner, passes, neighbours=5):
+    n = instance.n
+    Q = np.asarray(instance.Q)
+    D = np.asarray(instance.d, dtype=np.float64)[1:, 1:]
+    near = np.argsort(D + D.T, axis=1)[:, 1:neighbours+1]
+    boundary = [i for i in range(n-1) if np.any(label[near[i]] != label[i])]
+    where = {c: k for k, r in enumerate(route) for c in r}
+    moves = 0
+    for it in range(passes):
+        improved = False
+        for i in boundary:
+            a = where[i+1]
+            r = route[a]
+            pos_a = r.index(i+1)
+            removed = r[:pos_a] + r[pos_a+1:]
+            gain = cost[a] - shift_score(instance, removed, a)
+            parts = set(label[near[i]]) - {label[i]}
+            targets = [k for k in np.flatnonzero(Q[i] == 1)
+                       if owner[k] in parts and k != a]
+            best = (0, None, None)
+            for k in targets:
+                delta, pos = best_insertion(instance, route, cost, i+1, k)
+                if delta - gain < best[0] - 1e-9:
+                    best = (delta - gain, k, pos)
+            if best[1] is not None:
+                delta, k, pos = best
+                route[a] = removed
+                cost[a] -= gain
+                route[k].insert(pos, i+1)
+                cost[k] = shift_score(instance, route[k], k)
+                where[i+1] = k
+                moves += 1
+                improved = True
+        if not improved:
+            break
+    return moves
+
+# ------------------------------------------------------------------------------
+# main function
+# ------------------------------------------------------------------------------
+
+
+def decompose_solve(instance, size=100, workers=None, passes=2, **params):
+    t0 = time.time()
+    n, v = instance.n, instance.v
+    K = int(min(max(np.ceil((n-1)/size), 1), v))
+    label = partition_clients(dissimilarity(instance), K)
+    owner = partition_shifts(instance, label, K)
+    Q = np.asarray(instance.Q)
+
+    parts = []
+    orphans = []
+    for c in range(K):
+        shifts = np.flatnonzero(owner == c).tolist()
+        clients = []
+        for i in np.flatnonzero(label == c):
+            if np.any(Q[i, shifts] == 1):
+                clients.append(int(i) + 1)
+            else:
+                orphans.append(int(i) + 1)
+        if len(clients) < 2:
+            orphans += clients
+            continue
+        parts.append((clients, shifts))
+
+    seeds = np.random.randint(2**31 - 1, size=len(parts))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(solve_part, sub_instance(instance, clients, shifts),
+                               params, seed)
+                   for (clients, shifts), seed in zip(parts, seeds)]
+        results = [f.result() for f in futures]
+
+    # merge partial plans
+    route = [[] for k in range(v)]
+    for (clients, shifts), res in zip(parts, results):
+        for k, r in enumerate(res['route']):
+            route[shifts[k]] = [clients[i-1] for i in r]
+    cost = [shift_score(instance, r, k) for k, r in enumerate(route)]
+
+    repair(instance, route, cost, orphans)
+    moves = improve(instance, route, cost, label, owner, passes)
+
+    mod = schedule.Schedule(instance, route)
+    t1 = time.time()
+    print('decomposition into %d partitions finished in %s' %
+          (len(parts), str(datetime.timedelta(seconds=t1-t0))))
+
+    result = {}
+    result['params'] = dict(params, size=size, workers=workers, passes=passes)
+    result['time'] = t1 - t0
+    result['partitions'] = parts
+    result['part_scores'] = [res['score'] for res in results]
+    result['orphans'] = orphans
+    result['moves'] = moves
+    result['route'] = mod.route
+    result['arrival'] = mod.arrival
+    result['score'] = mod.evaluate()
+    result['distance'] = mod.distance()
+    result['waiting_time'] = mod.waiting_time()
+    result['shift_overtime'] = mod.shift_overtime()
+    return result
+
+
+if __name__ == "__main__":
+    ins = ins_module.Instance(120, 12)
+    res = decompose_solve(ins, size=30, generations=3)
+    print(res['score'], res['part_scores'], res['orphans'], res['moves'])
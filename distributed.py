@@ -0,0 +1,295 @@
+import hashlib
+import multiprocessing as mp
+import pickle
+import queue
+import socket
+import struct
+import threading
+import numpy as np
+import gomea
+
+"""
+module contains coordinator/worker mode for gomea over tcp
+
+main function is distributed_solve:
+    runs gomea_solve with a Coordinator as mixer, the coordinator keeps the
+    population and builds the linkage tree, workers do the optimal mixing
+    workers (list of (host, port)): addresses of running workers
+    batch (integer): number of individuals per batch
+    timeout (float): seconds before an unresponsive worker is dropped
+    remaining **params are gomea specs (single objective only)
+
+worker:
+    worker(port) serves one coordinator connection at a time and keeps every
+    instance it received in memory, keyed by content hash
+    spawn_workers(count) starts local worker processes (for testing)
+
+protocol:
+    messages are pickled python objects prefixed by their length (8 bytes),
+    pickle executes code on load, only connect workers on a trusted network
+    ('has', key) -> True/False: worker has the instance cached
+    ('load', key, instance) -> True: cache instance
+    ('state', key, gen, params, state) -> True: population state (keys,
+        scores, linkage tree, ...) of generation gen, once per generation
+    ('mix', key, gen, indices, seed) -> rows of mixed individuals
+    ('close',): ends the connection
+
+every generation the coordinator sends the population state once to every
+worker, followed by batches of individual indices only, a worker mixes its
+batches in place on its copy of the state (as nextGen does on the whole
+population), a batch of a lost worker (connection error or timeout) goes
+back to the queue for the remaining workers, and is mixed locally if no
+worker is left
+"""
+
+# ------------------------------------------------------------------------------
+# message protocol
+# ------------------------------------------------------------------------------
+
+
+def send_msg(sock, obj):
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    sock.sendall(struct.pack('!Q', len(data)) + data)
+
+
+def recv_exact(sock, size):
+    chunks = []
+    while size > 0:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError('connection closed')
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def recv_msg(sock):
+    size = struct.unpack('!Q', recv_exact(sock, 8))[0]
+    return pickle.loads(recv_exact(sock, size))
+
+
+def instance_key(instance):
+    return hashlib.sha1(pickle.dumps(instance.__dict__)).hexdigest()
+
+# ------------------------------------------------------------------------------
+# worker
+# ------------------------------------------------------------------------------
+
+
+COUNTERS = ['screened', 'skipped', 'evaluations', 'aborted', 'fosSkipped']
+
+
+def load_state(pop, params, state):
+    pop.adaptive = params['adaptive']
+    pop.explore = params['explore']
+    pop.loadState(state)
+    pop.noimprove = params['noimprove']
+    pop.visit = state['visit']
+
+
+def mix_batch(pop, indices, seed):
+    pop.rng = np.random.default_rng(seed)
+    before = {c: getattr(pop, c) for c in COUNTERS}
+    tries, success = pop.fosTries.copy(), pop.fosSuccess.copy()
+    pop.mixAll(indices, pop.noimprove, pop.visit)
+    return {'indices': indices,
+            'keys': pop.keys[indices], 'keyInts': pop.keyInts[indices],
+            'scores': pop.scores[indices],
+            'shiftScores': pop.shiftScores[indices],
+            'noImprove': pop.noImprove[indices],
+            'counters': {c: getattr(pop, c) - before[c] for c in COUNTERS},
+            'fosTries': pop.fosTries - tries,
+            'fosSuccess': pop.fosSuccess - success}
+
+
+def handle(conn, cache):
+    # generation of the state loaded per instance
+    loaded = {}
+    while True:
+        msg = recv_msg(conn)
+        if msg[0] == 'has':
+            send_msg(conn, msg[1] in cache)
+        elif msg[0] == 'load':
+            # an empty population holds instance-level data (bounds)
+            cache[msg[1]] = gomea.Population(msg[2], [])
+            send_msg(conn, True)
+        elif msg[0] == 'state':
+            key, gen, params, state = msg[1:]
+            load_state(cache[key], params, state)
+            loaded[key] = gen
+            send_msg(conn, True)
+        elif msg[0] == 'mix':
+            key, gen, indices, seed = msg[1:]
+            if loaded.get(key) != gen:
+                raise ConnectionError('no state for generation %r' % gen)
+            send_msg(conn, mix_batch(cache[key], indices, seed))
+        elif msg[0] == 'close':
+            return
+
+
+def worker(port, host='localhost', ready=None):
+    cache = {}
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind((host, port))
+    server.listen()
+    if ready is not None:
+        ready.put(server.getsockname()[1])
+    while True:
+        conn, addr = server.accept()
+        with conn:
+            try:
+                handle(conn, cache)
+            except (ConnectionError, EOFError):
+                pass
+
+
+# starts count local worker processes, returns processes and addresses
+def spawn_workers(count, host='localhost'):
+    ready = mp.Queue()
+    procs = []
+    for w in range(count):
+        proc = mp.Process(target=worker, args=(0, host, ready), daemon=True)
+        proc.start()
+        procs.append(proc)
+    return procs, [(host, ready.get()) for w in range(count)]
+
+# ------------------------------------------------------------------------------
+# coordinator
+# ------------------------------------------------------------------------------
+
+
+class Coordinator:
+    def __init__(self, workers, batch=10, timeout=60):
+        self.addresses = list(workers)
+        self.batch = batch
+        self.timeout = timeout
+        self.conns = {}
+        self.lost = []
+        self.key = None
+
+    def connect(self, address, instance):
+        conn = socket.create_connection(address, timeout=self.timeout)
+        send_msg(conn, ('has', self.key))
+        if not recv_msg(conn):
+            send_msg(conn, ('load', self.key, instance))
+            recv_msg(conn)
+        return conn
+
+    def drop(self, address):
+        conn = self.conns.pop(address, None)
+        if conn is not None:
+            conn.close()
+        self.lost.append(address)
+        print('lost worker', address)
+
+    def run(self, address, jobs, results, gen, params, state):
+        try:
+            conn = self.conns[address]
+            send_msg(conn, ('state', self.key, gen, params, state))
+            recv_msg(conn)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            self.drop(address)
+            return
+        while True:
+            try:
+                indices, seed = jobs.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                send_msg(conn, ('mix', self.key, gen, indices, seed))
+                results.put(recv_msg(conn))
+            except (OSError, EOFError, pickle.UnpicklingError):
+                jobs.put((indices, seed))
+                self.drop(address)
+                return
+
+    def nextGen(self, pop, deptype, noimprove):
+        if self.key is None:
+            self.key = instance_key(pop.instance)
+            for address in self.addresses:
+                try:
+                    self.conns[address] = self.connect(address, pop.instance)
+                except OSError:
+                    self.drop(address)
+
+        pop.reencode()
+        pop.buildTree(deptype)
+        state = pop.state()
+        params = {'noimprove': noimprove, 'adaptive': pop.adaptive,
+                  'explore': pop.explore}
+        jobs = queue.Queue()
+        for a in range(0, pop.size, self.batch):
+            indices = np.arange(a, min(a + self.batch, pop.size))
+            jobs.put((indices, pop.rng.integers(2**31 - 1)))
+        results = queue.Queue()
+        threads = [threading.Thread(target=self.run,
+                                    args=(address, jobs, results,
+                                          pop.generation, params, state))
+                   for address in list(self.conns)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        while not results.empty():
+            row = results.get()
+            idx = row['indices']
+            pop.keys[idx] = row['keys']
+            pop.keyInts[idx] = row['keyInts']
+            pop.scores[idx] = row['scores']
+            pop.shiftScores[idx] = row['shiftScores']
+            pop.noImprove[idx] = row['noImprove']
+            for c, value in row['counters'].items():
+                setattr(pop, c, getattr(pop, c) + value)
+            pop.fosTries += row['fosTries']
+            pop.fosSuccess += row['fosSuccess']
+            for i in idx:
+                pop.updateElitist(i)
+
+        # no worker left: remaining batches are mixed locally
+        while not jobs.empty():
+            indices, seed = jobs.get()
+            pop.mixAll(indices, noimprove, state['visit'])
+
+    def close(self):
+        for address in list(self.conns):
+            try:
+                send_msg(self.conns[address], ('close',))
+            except OSError:
+                pass
+            self.conns.pop(address).close()
+
+# ------------------------------------------------------------------------------
+# main function
+# ------------------------------------------------------------------------------
+
+
+def distributed_solve(instance, workers, batch=10, timeout=60, callback=None,
+                      **params):
+    if params.get('multiobjective'):
+        raise ValueError('distributed mode supports single objective only')
+    coordinator = Coordinator(workers, batch, timeout)
+    try:
+        result = gomea.gomea_solve(instance, callback=callback,
+                                   mixer=coordinator, **params)
+    finally:
+        coordinator.close()
+    result['lost_workers'] = coordinator.lost
+    return result
+
+
+if __name__ == "__main__":
+    import instance
+    ins = instance.Instance(40, 5)
+    procs, addresses = spawn_workers(3)
+
+    # kill one worker after the first generation to show recovery
+    def kill(pop, g):
+        if g == 0:
+            procs[0].terminate()
+        return False
+
+    res = distributed_solve(ins, addresses, batch=20, callback=kill,
+                            generations=4, population=100)
+    print(res['score'], res['lost_workers'])
@@ -1,11 +1,8 @@
 import numpy as np
-import operator
-from scipy.cluster.hierarchy import linkage
 import schedule
 import measures
 import time
 import datetime
-import importlib
 
 """
 module contains algorithm for (generalized permutation) gomea
@@ -14,19 +11,46 @@ main function is gomea_solve:
     executes gomea on instance (class object from Instance module)
     parameters are contained in specs dictionary
     set parameters manually with **params
+    optional callback(population, generation) runs after every generation,
+    returning True from it stops the process
+    optional mixer object: mixer.nextGen(population, deptype, noimprove)
+    replaces population.nextGen (e.g. distributed.Coordinator)
+    optional context (SolverContext) or seed (not both, a context is seeded
+    when it is created): parameters and random generator of a run live in
+    the context, buffers in its population, no module state
+    is shared, solves with separate contexts are independent and can run in
+    parallel threads, without seed
+    the generator is seeded from the global numpy random state
     returns dictionary containing route, arrival, score, running time and parameter settings
+    with multiobjective=True it also returns the approximated pareto front
+    over (distance, shift_overtime, waiting_time), see front_lookup
     
 components:
     Individual class: methods and attributes for a schedule
         - key: encoding of schedule
         - score: evaluation of schedule
     
-    Population class: pool of individuals (objects from Individual class)
+    SolverContext class: parameters and np.random.Generator of a run
+
+    Population class: pool of individuals stored as contiguous arrays
+        - keys: P x n matrix of random keys (one row per individual)
+        - keyInts: P x n matrix of shift indices (small integer dtype)
+        - scores: vector of P evaluations
+        - objectives, weights: P x 3 objective values and weight vectors
+          (multiobjective only, scores are the weighted objectives)
+        - individuals: Individual views on the rows of above arrays
         - buildTree: loads linkage-tree
         - nextGen: performs selection and variation procedure on population
+          (optionally adaptive: unproductive FOS elements are visited less)
+
+    ParetoArchive class: non-dominated (distance, overtime, waiting time)
+    solutions over all evaluated candidates (multiobjective only)
             
 note that linkage module builds linkage-tree based on minimum distance
 while in description of gomea  linkage-tree is based on maximum distance
+
+scipy is imported on first use (buildTree), importing this module only
+requires numpy
 """
 
 # =================================SPECS========================================
@@ -35,56 +59,129 @@ while in description of gomea  linkage-tree is based on maximum distance
 generations (integer): number of generations
 population (integer): population size
 startpopulation (list or None type): option to manually input a start population of routes
-deptype (1,2 or 3): choice of dependency measure: extended pGOMEA (1), standard pGOMEA (2), random (3)
-threshold (float): threshold on ratio of score from last two generations
-stop (integer): stops process if flat (counter) hits stop
+deptype (1,2,3 or 4): choice of dependency measure: extended pGOMEA (1), standard pGOMEA (2), random (3),
+    static (4): built once from the instance (d, tw, Q), see measures.static_depcy_block
+blend (float): deptype 4 only, weight of the extended measure (1) blended into
+    the static measure every relearn generations (0: static tree only)
+relearn (integer): deptype 4 only, generations between blended trees
+noimprove (integer or None): generations without improvement of an individual
+    before a forced improvement with the elitist as donor (None disables it)
+stop (integer): stops process if the elitist has not improved for stop generations
+memlimit (integer or None): memory ceiling in bytes for the temporaries of
+    the dependency computation, which then runs in blocks of pairs
+disttype ('float64' or 'float32'): dtype of the condensed distance buffer,
+    float32 only shrinks the buffer kept between generations, linkage
+    converts it to a float64 copy, which raises the peak memory of buildTree
+multiobjective (boolean): every individual optimizes its own weighting of
+    distance, overtime and waiting time, all evaluated candidates are kept
+    in a pareto archive which is returned as front
+adaptive (boolean): visits FOS elements with a probability that follows the
+    success rate of mixing for their cluster size
+explore (float): minimum visit probability of a FOS element (adaptive only)
+encoding ('keys' or 'ranks'): random keys (shift + uniform) or integer keys
+    packing shift and position rank (shift * RANKS + rank)
+keytype ('float64' or 'float32'): dtype of random keys (encoding 'keys' only),
+    float32 halves the key matrix, keys are drawn such that they stay below
+    the next shift and never tie after rounding
+init ('random' or 'insertion'): start population of random routes or of
+    randomized time window ordered insertion (schedule.insertion_routes)
 '''
 
 specs = {'generations': 20,
          'population': 200,  # 400,
          'startpop': None,
          'deptype': 1,
-         'threshold': 0.01,
-         'stop': 2
+         'blend': 0,
+         'relearn': 5,
+         'noimprove': 2,
+         'stop': 2,
+         'memlimit': 2**28,
+         'disttype': 'float64',
+         'multiobjective': False,
+         'adaptive': False,
+         'explore': 0.1,
+         'encoding': 'keys',
+         'keytype': 'float64',
+         'init': 'random'
          }
 
-# ==============================================================================
+# dependency measures, see deptype in specs
+DEPTYPES = (1, 2, 3, 4)
 
+# score of candidates evaluated beyond their cutoff
+REJECTED = schedule.REJECTED
 
-def gomea_solve(instance, **params):
+# rank encoding: key = shift * RANKS + rank of client within its shift
+RANK_BITS = 32
+RANKS = 2**RANK_BITS
 
-    # to reset measures.binom_cdf_storage for a fair comparison
-    importlib.reload(measures)
+# ==============================================================================
 
-    # initialization: loads input or from specs dict if no input
-    def getparam(p): return specs[p] if p not in params else params[p]
-    pm = {}
-    for key in specs:
-        pm[key] = getparam(key)
+
+def gomea_solve(instance, callback=None, mixer=None, context=None, seed=None,
+                **params):
+
+    # initialization: specs dict updated with input, held by the context
+    if context is None:
+        context = SolverContext(params, seed)
+    elif seed is not None:
+        raise ValueError('pass either a context or a seed, not both')
+    else:
+        context.params.update(params)
+    pm = context.params
+    rng = context.rng
 
     P = pm['population']
     G = pm['generations']
     startpop = pm['startpop']
     deptype = pm['deptype']
-    threshold = pm['threshold']
+    if deptype not in DEPTYPES:
+        raise ValueError('unknown deptype %r' % (deptype,))
+    blend = pm['blend']
+    relearn = pm['relearn']
+    noimprove = pm['noimprove']
     stop = pm['stop']
+    memlimit = pm['memlimit']
+    disttype = np.dtype(pm['disttype'])
+    multiobjective = pm['multiobjective']
+    adaptive = pm['adaptive']
+    explore = pm['explore']
+    if pm['encoding'] == 'ranks':
+        keytype = np.int64
+    elif np.dtype(pm['keytype']) in (np.float64, np.float32):
+        keytype = np.dtype(pm['keytype']).type
+    else:
+        raise ValueError('unsupported keytype %r' % (pm['keytype'],))
 
-    if startpop == None:
-        models = [schedule.Schedule(instance) for i in range(P)]
+    if startpop == None and pm['init'] == 'insertion':
+        routes = schedule.insertion_routes(instance, P, rng=rng)
+    elif startpop == None:
+        models = [schedule.Schedule(instance, rng=rng) for i in range(P)]
         routes = [mod.route for mod in models]
-        pop = Population(instance, routes)
     else:
-        pop = Population(instance, params['startpop'])
+        routes = startpop
+    if multiobjective:
+        weights = simplex_weights(len(routes), rng)
+        archive = ParetoArchive()
+    else:
+        weights, archive = None, None
+    pop = Population(instance, routes, context=context, keytype=keytype,
+                     disttype=disttype, memlimit=memlimit,
+                     weights=weights, archive=archive, adaptive=adaptive,
+                     explore=explore, blend=blend, relearn=relearn)
 
     t = 0
     time_tracker = [0]
     g = 0
-    prog = Progress(threshold, stop)
+    prog = Progress(stop)
     prog.update(pop)
     while prog.go() and g < G:
         t0 = time.time()
         pop.generation = g
-        pop.nextGen(deptype)
+        if mixer is None:
+            pop.nextGen(deptype, noimprove)
+        else:
+            mixer.nextGen(pop, deptype, noimprove)
         prog.update(pop)
         t1 = time.time()
         print("evolution cycle %d finished in %s" %
@@ -92,9 +189,10 @@ def gomea_solve(instance, **params):
         t += t1 - t0
         time_tracker.append(t)
         g += 1
+        if callback is not None and callback(pop, g-1):
+            break
 
-    bestIndIdx = np.argmin([ind.score for ind in pop.individuals])
-    route = decode(pop.individuals[bestIndIdx].key, instance)
+    route = decode(pop.eliteKey, instance)
     mod = schedule.Schedule(instance, route)
 
     print('\n')
@@ -112,35 +210,53 @@ def gomea_solve(instance, **params):
     result['shift_overtime'] = mod.shift_overtime()
     result['progress'] = prog.progress
     result['pop_means'] = prog.pop_means
+    result['evaluations'] = pop.evaluations
+    result['screened'] = pop.screened
+    result['skipped'] = pop.skipped
+    result['aborted'] = pop.aborted
+    result['fos_skipped'] = pop.fosSkipped
+    result['fos_stats'] = pop.fos_stats()
+    result['dist_memory'] = pop.distPeak
+    result['tree_time'] = pop.treeTime
+    result['peak_memory'] = peak_memory()
+    if multiobjective:
+        result['front'] = archive.front(instance)
     result['instance'] = instance.__dict__
 
     return result
 
+# per-run state: parameters (specs updated with params) and random generator
+class SolverContext:
+    def __init__(self, params=None, seed=None, rng=None):
+        self.params = dict(specs)
+        self.params.update(params or {})
+        self.rng = schedule.generator(rng if rng is not None else seed)
+
+
 # keeps track of meta-parameters when to stop process
 
 
 class Progress:
-    def __init__(self, threshold, stop):
+    def __init__(self, stop):
         self.progress = []
         self.pop_means = []
         self.flat = 0
-        self.threshold = threshold
         self.stop = stop
+        self.changes = None
 
-    def ratio(self, x, y):
-        return abs(x-y)/max(x, y)
-
+    # progress follows the elitist archive, so it never gets worse
+    # (multiobjective: any change of the pareto archive counts as progress)
     def update(self, population):
-        pop = population
-        scores = [ind.score for ind in pop.individuals]
-        topscore = min(scores)
-        self.progress.append(topscore)
-        self.pop_means.append(np.mean(scores))
-        if len(self.progress) > 2:
-            if self.ratio(self.progress[-1], self.progress[-2]) <= self.threshold:
-                self.flat += 1
-            else:
+        self.progress.append(population.eliteScore)
+        self.pop_means.append(np.mean(population.scores))
+        archive = population.archive
+        changes = None if archive is None else archive.changes
+        if len(self.progress) > 1:
+            if self.progress[-1] < self.progress[-2] or changes != self.changes:
                 self.flat = 0
+            else:
+                self.flat += 1
+        self.changes = changes
 
     def go(self):
         if self.flat < self.stop:
@@ -149,75 +265,566 @@ class Progress:
             return False
 
 
+# view on a single row of the population arrays
 class Individual:
-    def __init__(self, instance, route):
-        self.instance = instance
-        self.key, self.keyInt, self.keyDec = encode(route)
-        self.score = evaluate(self.key, instance)
+    def __init__(self, population, idx):
+        self.population = population
+        self.instance = population.instance
+        self.idx = idx
+
+    @property
+    def key(self):
+        return self.population.keys[self.idx]
+
+    @key.setter
+    def key(self, value):
+        self.population.keys[self.idx] = value
+
+    @property
+    def keyInt(self):
+        return self.population.keyInts[self.idx]
+
+    @keyInt.setter
+    def keyInt(self, value):
+        self.population.keyInts[self.idx] = value
+
+    @property
+    def keyDec(self):
+        return key_fraction(self.key)
+
+    @property
+    def score(self):
+        return self.population.scores[self.idx]
+
+    @score.setter
+    def score(self, value):
+        self.population.scores[self.idx] = value
 
     def reencode(self):
-        self.key, self.keyInt, self.keyDec = encode(
-            decode(self.key, self.instance))
+        keys = self.population.keys[self.idx:self.idx+1]
+        keyInts = self.population.keyInts[self.idx:self.idx+1]
+        redraw_keys(keys, keyInts, np.argsort(keys, axis=1, kind='stable'),
+                    self.population.rng)
 
     def resize(self):
-        if np.random.rand() > 0.1:
+        if self.population.rng.random() > 0.1:
             self.reencode()
 
 
 class Population:
-    def __init__(self, instance, routes, tree=None):
+    def __init__(self, instance, routes, tree=None, context=None,
+                 keytype=np.float64,
+                 disttype=np.float64, memlimit=None, weights=None, archive=None,
+                 adaptive=False, explore=0.1, blend=0, relearn=5):
         self.instance = instance
-        self.individuals = [Individual(instance, route) for route in routes]
-        self.size = len(self.individuals)
+        self.context = context if context is not None else SolverContext()
+        self.rng = self.context.rng
+        self.size = len(routes)
+        n = instance.n-1
+        self.keys = np.zeros((self.size, n), dtype=keytype)
+        self.keyInts = np.zeros(
+            (self.size, n), dtype=np.min_scalar_type(max(instance.v-1, 0)))
+        self.scores = np.zeros(self.size)
+        # difference of two keys on the same shift as a fraction of a shift
+        self.keyScale = float(RANKS) if is_ranks(self.keys) else 1.0
+        for idx, route in enumerate(routes):
+            key, keyInt, keyDec = encode(route, self.rng)
+            self.keyInts[idx] = keyInt
+            # integer and narrow float keys are drawn in their own dtype
+            if is_ranks(self.keys) or self.keys.dtype != np.float64:
+                redraw_keys(self.keys[idx:idx+1], self.keyInts[idx:idx+1],
+                            np.argsort(key, kind='stable')[None, :], self.rng)
+            else:
+                self.keys[idx] = key
+        fit_keys(self.keys, self.keyInts)
+        self.weights = weights
+        self.archive = archive
+        self.objectives = None
+        if archive is not None:
+            self.objectives = np.zeros((self.size, 3))
+
+        # single objective: score per shift, lower bounds for screening
+        # candidates and counters for (skipped) evaluations
+        self.shiftScores = np.zeros((self.size, instance.v))
+        self.tardiness = tardiness_bounds(instance)
+        self.tardy = bool(np.any(self.tardiness > 0))
+        self.screened = 0
+        self.skipped = 0
+        self.evaluations = 0
+        self.aborted = 0
+
+        for idx in range(self.size):
+            self.rescore(idx)
+        self.individuals = [Individual(self, idx) for idx in range(self.size)]
         self.tree = tree
         self.generation = 0
 
+        # condensed distance buffer, reused by buildTree every generation
+        self.disttype = disttype
+        self.memlimit = memlimit
+        self.distbuf = None
+        self.distPeak = 0
+        self.treeTime = 0
+
+        # static dependencies (deptype 4), computed once per population
+        self.static = None
+        self.blend = blend
+        self.relearn = relearn
+
+        # FOS elements of the current tree, mixing tries and successes per
+        # cluster size and number of FOS elements skipped (adaptive)
+        self.fos = None
+        self.adaptive = adaptive
+        self.explore = explore
+        self.fosTries = np.zeros(n+1, dtype=np.int64)
+        self.fosSuccess = np.zeros(n+1, dtype=np.int64)
+        self.fosSkipped = 0
+
+        # generations since last improvement per individual
+        self.noImprove = np.zeros(self.size, dtype=np.int64)
+
+        # elitist archive: best solution ever found, kept outside the population
+        self.eliteKey = None
+        self.eliteKeyInt = None
+        self.eliteScore = np.inf
+        if self.size > 0:
+            self.updateElitist(np.argmin(self.scores))
+
+    # multiobjective: elitist is the archived solution with weights (1, 1, 1)
+    def updateElitist(self, idx):
+        if self.archive is not None:
+            key, obj = self.archive.best(np.ones(3))
+            if obj.sum() < self.eliteScore:
+                self.eliteScore = obj.sum()
+                self.eliteKey = key.copy()
+                self.eliteKeyInt = key_shifts(key).astype(self.keyInts.dtype)
+        elif self.scores[idx] < self.eliteScore:
+            self.eliteScore = self.scores[idx]
+            self.eliteKey = self.keys[idx].copy()
+            self.eliteKeyInt = self.keyInts[idx].copy()
+
+    # returns donor for forced improvements of individual idx
+    def elitist(self, idx):
+        if self.archive is None:
+            return self.eliteKey, self.eliteKeyInt
+        key, obj = self.archive.best(self.weights[idx])
+        return key, key_shifts(key).astype(self.keyInts.dtype)
+
+    # returns score of candidate key for individual idx (and its objectives,
+    # which are offered to the archive, if multiobjective)
+    def trial(self, candkey, idx):
+        if self.archive is None:
+            return evaluate(candkey, self.instance), None
+        obj = evaluate_objectives(candkey, self.instance)
+        self.archive.add(obj, candkey)
+        return np.dot(self.weights[idx], obj), obj
+
+    # recomputes (shift) scores of individual idx from its key
+    def rescore(self, idx):
+        if self.archive is None:
+            shifts = np.arange(self.instance.v)
+            routes = decode_shifts(self.keys[idx], self.keyInts[idx], shifts)
+            self.shiftScores[idx] = self.shift_costs(routes, shifts)
+            self.scores[idx] = self.shiftScores[idx].sum()
+        else:
+            self.scores[idx], self.objectives[idx] = self.trial(
+                self.keys[idx], idx)
+
+    def shift_costs(self, routes, shifts):
+        ins = self.instance
+        return np.array([schedule.r_score(r, k, ins.d, ins.p, ins.tw, ins.u, ins.ss)
+                         for r, k in zip(routes, shifts)], dtype=np.float64)
+
+    # travel distance plus minimal time window tardiness never exceeds the
+    # score of a shift, as overtime and waiting time are nonnegative
+    def lower_bounds(self, routes, shifts):
+        d = self.instance.d
+        dists = [schedule.r_distance(r, d) if len(r) > 0 else 0 for r in routes]
+        tards = [0 for r in routes]
+        if self.tardy:
+            tards = [sum([self.tardiness[i-1, k] for i in r])
+                     for r, k in zip(routes, shifts)]
+        return dists, tards
+
+    # completes lower bounds to shift scores in given order of shifts,
+    # returns None as soon as the running total reaches cutoff
+    def complete_costs(self, routes, shifts, dists, tards, order, cutoff=np.inf):
+        ins = self.instance
+        costs = np.array(dists, dtype=np.float64)
+        running = sum(dists) + sum(tards)
+        for j in order:
+            r = routes[j]
+            if len(r) == 0:
+                continue
+            running -= tards[j]
+            late = schedule.r_lateness(r, shifts[j], ins.d, ins.p, ins.tw,
+                                       ins.u, ins.ss, cutoff - running)
+            if late == REJECTED:
+                return None
+            running += late
+            costs[j] += late
+        return costs
+
+    # copies donor values on FOS into a candidate for individual idx and
+    # accepts it on strict improvement, single objective candidates are
+    # only evaluated (on their changed shifts) if their lower bound is
+    # better than the current score, most expensive shifts first and
+    # aborted once the current score is reached
+    def mix(self, idx, FOS, donorKey, donorInt, candkey, candInt):
+        np.copyto(candkey, self.keys[idx])
+        candkey[FOS] = donorKey[FOS]
+        if self.archive is not None:
+            s, obj = self.trial(candkey, idx)
+            if s >= self.scores[idx]:
+                return False
+            self.objectives[idx] = obj
+        else:
+            np.copyto(candInt, self.keyInts[idx])
+            candInt[FOS] = donorInt[FOS]
+            changed = sorted(set(self.keyInts[idx, FOS].tolist()) |
+                             set(donorInt[FOS].tolist()))
+            routes = decode_shifts(candkey, candInt, changed)
+            old = self.shiftScores[idx, changed]
+            base = self.scores[idx] - old.sum()
+            dists, tards = self.lower_bounds(routes, changed)
+            self.screened += 1
+            if base + sum(dists) + sum(tards) >= self.scores[idx]:
+                self.skipped += 1
+                return False
+            self.evaluations += 1
+            costs = self.complete_costs(routes, changed, dists, tards,
+                                        np.argsort(-old, kind='stable'),
+                                        self.scores[idx] - base)
+            if costs is None:
+                self.aborted += 1
+                return False
+            s = base + costs.sum()
+            if s >= self.scores[idx]:
+                return False
+            self.shiftScores[idx, changed] = costs
+            s = self.shiftScores[idx].sum()
+        self.scores[idx] = s
+        self.keys[idx, FOS] = donorKey[FOS]
+        self.keyInts[idx, FOS] = donorInt[FOS]
+        return True
+
+    # draws fresh sorted random keys per shift while preserving all routes
     def reencode(self):
-        for individual in self.individuals:
-            individual.reencode()
+        order = np.argsort(self.keys, axis=1, kind='stable')
+        redraw_keys(self.keys, self.keyInts, order, self.rng)
 
     def buildTree(self, deptype):
-        self.tree = linkage(
-            distances(self.individuals, self.instance, deptype), method='average')
-
-    def nextGen(self, deptype):
+        t0 = time.time()
         n = self.instance.n-1
+        if self.distbuf is None:
+            self.distbuf = np.empty(n*(n-1)//2, dtype=self.disttype)
+        if deptype == 4:
+            learn = self.blend > 0 and self.generation % self.relearn == 0
+            if self.static is not None and not learn:
+                # static tree (or last blended tree) is kept
+                return
+            if self.static is None:
+                self.static = distances(self, self.instance, 4,
+                                        out=np.empty_like(self.distbuf),
+                                        memlimit=self.memlimit)
+            if learn:
+                distances(self, self.instance, 1,
+                          out=self.distbuf, memlimit=self.memlimit)
+                self.distbuf *= self.blend
+                self.distbuf += (1 - self.blend)*self.static
+            else:
+                self.distbuf[:] = self.static
+        else:
+            distances(self, self.instance, deptype,
+                      out=self.distbuf, memlimit=self.memlimit)
+        block = block_size(self, self.instance, self.memlimit)
+        static = 0 if self.static is None else self.static.nbytes
+        # linkage works on a float64 copy of a narrower buffer
+        copy = 0 if self.distbuf.dtype == np.float64 else 8*len(self.distbuf)
+        self.distPeak = max(self.distPeak, self.distbuf.nbytes + static +
+                            max(copy, block*measures.block_bytes(
+                                self.size, self.instance.v)))
+        from scipy.cluster.hierarchy import linkage
+        self.tree = linkage(self.distbuf, method='average')
+        self.fos = fos_sets(self.tree, n)
+        self.treeTime += time.time() - t0
+
+    # visit probability per FOS element: success rate of its cluster size
+    # (with one prior success in two tries) relative to the overall success
+    # rate, cluster sizes with above average yield are always visited
+    def visit_probabilities(self):
+        rate = (self.fosSuccess + 1)/(self.fosTries + 2)
+        overall = (self.fosSuccess.sum() + 1)/(self.fosTries.sum() + 2)
+        sizes = np.array([len(FOS) for FOS in self.fos])
+        return np.clip(rate[sizes]/overall, self.explore, 1)
+
+    def fos_stats(self):
+        sizes = np.flatnonzero(self.fosTries)
+        return [{'size': int(z), 'tries': int(self.fosTries[z]),
+                 'successes': int(self.fosSuccess[z]),
+                 'rate': self.fosSuccess[z]/self.fosTries[z]} for z in sizes]
+
+    def nextGen(self, deptype, noimprove=None):
         self.reencode()
         self.buildTree(deptype)
-        for individual in self.individuals:
-            order = np.random.permutation(2 * n - 1)
-            for i in order:
-                candkey = individual.key + 0
-                FOS = getset(self.tree, i, n)
-                k = np.random.randint(0, self.size)
-                for j in FOS:
-                    candkey[j] = self.individuals[k].key[j]
-                s = evaluate(candkey, self.instance)
-                if s < individual.score:
-                    individual.score = s
-                    individual.key = candkey
-                    individual.keyInt[FOS] = self.individuals[k].keyInt[FOS]
-                    individual.keyDec[FOS] = self.individuals[k].keyDec[FOS]
+        self.mixAll(range(self.size), noimprove)
+
+    # optimal mixing (and forced improvements) for individuals in indices
+    def mixAll(self, indices, noimprove=None, visit=None):
+        n = self.instance.n-1
+        candkey = np.empty(n, dtype=self.keys.dtype)
+        candInt = np.empty(n, dtype=self.keyInts.dtype)
+        if self.adaptive and visit is None:
+            visit = self.visit_probabilities()
+        for idx in indices:
+            self.mixIndividual(idx, noimprove, candkey, candInt, visit)
+
+    def mixIndividual(self, idx, noimprove, candkey, candInt, visit=None):
+        n = self.instance.n-1
+        keys, keyInts = self.keys, self.keyInts
+        improved = False
+        order = self.rng.permutation(2 * n - 1)
+        if self.adaptive:
+            skip = self.rng.uniform(size=2 * n - 1) >= visit[order]
+            self.fosSkipped += np.count_nonzero(skip)
+            order = order[~skip]
+        for i in order:
+            FOS = self.fos[i]
+            k = self.rng.integers(0, self.size)
+            success = self.mix(idx, FOS, keys[k], keyInts[k], candkey, candInt)
+            self.fosTries[len(FOS)] += 1
+            if success:
+                self.fosSuccess[len(FOS)] += 1
+                improved = True
+        if improved:
+            self.noImprove[idx] = 0
+            self.updateElitist(idx)
+        else:
+            self.noImprove[idx] += 1
+        if noimprove is not None and self.noImprove[idx] >= noimprove:
+            self.forcedImprovement(idx, candkey, candInt)
+            self.noImprove[idx] = 0
+
+    # arrays needed to mix a copy of the population elsewhere (single objective)
+    def state(self):
+        return {'keys': self.keys, 'keyInts': self.keyInts,
+                'scores': self.scores, 'shiftScores': self.shiftScores,
+                'noImprove': self.noImprove, 'tree': self.tree,
+                'eliteKey': self.eliteKey, 'eliteKeyInt': self.eliteKeyInt,
+                'eliteScore': self.eliteScore,
+                'visit': self.visit_probabilities() if self.adaptive else None}
+
+    def loadState(self, state):
+        for name in ['keys', 'keyInts', 'scores', 'shiftScores', 'noImprove',
+                     'tree', 'eliteKey', 'eliteKeyInt', 'eliteScore']:
+            setattr(self, name, state[name])
+        self.size = len(self.scores)
+        self.keyScale = float(RANKS) if is_ranks(self.keys) else 1.0
+        self.fos = fos_sets(self.tree, self.instance.n-1)
+        self.individuals = [Individual(self, idx) for idx in range(self.size)]
+
+    # replaces the worst individual by a (better) migrant solution, the
+    # migrant's route is redrawn in the keys of this population (its
+    # encoding and keytype may differ)
+    def immigrate(self, key, keyInt, score):
+        worst = np.argmax(self.scores)
+        if score < self.scores[worst]:
+            self.keyInts[worst] = keyInt
+            redraw_keys(self.keys[worst:worst+1],
+                        self.keyInts[worst:worst+1],
+                        np.argsort(key, kind='stable')[None, :], self.rng)
+            self.rescore(worst)
+            self.noImprove[worst] = 0
+            self.updateElitist(worst)
+
+    # mixes with the elitist as donor until the first strict improvement,
+    # if none is found the individual is replaced by the elitist, keys are
+    # compared on the schedule they encode (reencode redraws them)
+    def forcedImprovement(self, idx, candkey, candInt):
+        n = self.instance.n-1
+        eliteKey, eliteKeyInt = self.elitist(idx)
+        if same_structure(self.keys[idx], self.keyInts[idx],
+                          eliteKey, eliteKeyInt):
+            return
+        order = self.rng.permutation(2 * n - 1)
+        for i in order:
+            FOS = self.fos[i]
+            if same_structure(self.keys[idx, FOS], self.keyInts[idx, FOS],
+                              eliteKey[FOS], eliteKeyInt[FOS]):
+                continue
+            if self.mix(idx, FOS, eliteKey, eliteKeyInt, candkey, candInt):
+                self.updateElitist(idx)
+                return
+        self.keys[idx] = eliteKey
+        self.keyInts[idx] = eliteKeyInt
+        self.rescore(idx)
+
+
+class ParetoArchive:
+    def __init__(self):
+        self.objectives = np.zeros((0, 3))
+        self.keys = []
+        self.changes = 0
+
+    # adds solution if no archived solution dominates or equals it and
+    # removes the archived solutions it dominates
+    def add(self, obj, key):
+        A = self.objectives
+        if np.any(np.all(A <= obj, axis=1)):
+            return False
+        keep = ~np.all(obj <= A, axis=1)
+        self.objectives = np.vstack((A[keep], obj))
+        self.keys = [k for k, b in zip(self.keys, keep) if b] + [key.copy()]
+        self.changes += 1
+        return True
+
+    # returns archived key and objectives with lowest weighted score
+    def best(self, weights):
+        i = np.argmin(self.objectives @ weights)
+        return self.keys[i], self.objectives[i]
+
+    def front(self, instance):
+        order = np.lexsort(self.objectives.T[::-1])
+        return [{'distance': self.objectives[i, 0],
+                 'shift_overtime': self.objectives[i, 1],
+                 'waiting_time': self.objectives[i, 2],
+                 'route': decode(self.keys[i], instance)} for i in order]
+
+
+# returns the front solution with the lowest score for given weights
+def front_lookup(front, wx=1, wy=1, wz=1):
+    return min(front, key=lambda f: wx*f['distance'] + wy*f['shift_overtime']
+               + wz*f['waiting_time'])
+
+
+# weight vectors on the simplex scaled to sum 3, first one is (1, 1, 1)
+def simplex_weights(size, rng):
+    w = 3*rng.dirichlet(np.ones(3), size=size)
+    w[0] = 1
+    return w
 
 # ------------------------------------------------------------------------------
 # support functions for Individual class
 # ------------------------------------------------------------------------------
 
 
-def evaluate(key, instance):
+# returns score of key, or REJECTED as soon as the running total reaches
+# cutoff (longest routes are scored first)
+def evaluate(key, instance, cutoff=None):
+    route = decode(key, instance)
+    if cutoff is None:
+        model = schedule.Schedule(instance, route=route)
+        return model.evaluate()
+    ins = instance
+    dists = [schedule.r_distance(r, ins.d) if len(r) > 0 else 0 for r in route]
+    running = sum(dists)
+    if running >= cutoff:
+        return REJECTED
+    for k in sorted(range(ins.v), key=lambda k: -len(route[k])):
+        if len(route[k]) == 0:
+            break
+        late = schedule.r_lateness(route[k], k, ins.d, ins.p, ins.tw,
+                                   ins.u, ins.ss, cutoff - running)
+        if late == REJECTED:
+            return REJECTED
+        running += late
+    return running
+
+
+# returns (distance, shift_overtime, waiting_time)
+def evaluate_objectives(key, instance):
     route = decode(key, instance)
     model = schedule.Schedule(instance, route=route)
-    return model.evaluate()
-
-
-def encode(route):
+    return np.array([model.distance(), model.shift_overtime(),
+                     model.waiting_time()], dtype=np.float64)
+
+
+# returns routes of given shifts, as decode does for all shifts
+def decode_shifts(key, keyInt, shifts):
+    order = np.argsort(key, kind='stable')
+    # sorting keys groups clients per shift (keyInt is the integer part)
+    bounds = np.searchsorted(keyInt[order], [shifts, np.add(shifts, 1)])
+    clients = (order + 1).tolist()
+    return [clients[a:b] for a, b in zip(bounds[0].tolist(), bounds[1].tolist())]
+
+
+# minimal time window tardiness of client i (row i-1) on shift k, arrival
+# is at least shift start plus shortest path length from base
+def tardiness_bounds(instance):
+    n = instance.n
+    d = np.asarray(instance.d, dtype=np.float64)
+    sp = d[0].copy()
+    while True:
+        nxt = np.minimum(sp, (sp[:, None] + d).min(axis=0))
+        if np.array_equal(nxt, sp):
+            break
+        sp = nxt
+    end = np.array([instance.tw[i][1] for i in range(1, n)], dtype=np.float64)
+    ss = np.asarray(instance.ss, dtype=np.float64)
+    return np.maximum(0, ss[None, :] + sp[1:n, None] - end[:, None])
+
+
+# returns shift of every client encoded in key
+def key_shifts(key):
+    if is_ranks(key):
+        return key >> RANK_BITS
+    return key.astype(np.int64)
+
+
+# returns position of every client within its shift as a fraction in [0, 1)
+def key_fraction(key):
+    if is_ranks(key):
+        return (key & (RANKS - 1))/RANKS
+    return key - key_shifts(key)
+
+
+def is_ranks(key):
+    return np.issubdtype(key.dtype, np.integer)
+
+
+# returns new keys for rows of nondecreasing shifts (clients in route order)
+def draw_keys(shifts, dtype, rng):
+    if np.issubdtype(dtype, np.integer):
+        n = shifts.shape[1]
+        u = rng.integers(0, RANKS - n, size=shifts.shape, dtype=np.int64)
+        r = np.sort((shifts.astype(np.int64) << RANK_BITS) + u, axis=1)
+        # make ranks strictly increasing, which keeps them below RANKS
+        j = np.arange(n, dtype=np.int64)
+        return np.maximum.accumulate(r - j, axis=1) + j
+    # sorting shift + uniform sorts the uniforms within each shift only
+    if np.dtype(dtype) == np.float64 or shifts.size == 0:
+        return np.sort(shifts + rng.uniform(size=shifts.shape), axis=1)
+    # narrow floats: uniforms leave room for one ulp per client below the
+    # next shift, keys that are equal after rounding are moved up by one ulp
+    dtype = np.dtype(dtype)
+    n = shifts.shape[1]
+    room = 1 - n*float(np.spacing(dtype.type(shifts.max() + 1)))
+    keys = np.sort(shifts + room*rng.uniform(size=shifts.shape),
+                   axis=1).astype(dtype)
+    top = dtype.type(np.inf)
+    while True:
+        tie = keys[:, 1:] <= keys[:, :-1]
+        if not tie.any():
+            return keys
+        keys[:, 1:][tie] = np.nextafter(keys[:, :-1][tie], top)
+
+
+# draws fresh keys per shift for clients ordered as in order (per row)
+def redraw_keys(keys, keyInts, order, rng):
+    shifts = np.take_along_axis(keyInts, order, axis=1)
+    np.put_along_axis(keys, order, draw_keys(shifts, keys.dtype, rng), axis=1)
+    fit_keys(keys, keyInts)
+
+
+def encode(route, rng=None):
+    rng = schedule.generator(rng)
     route = schedule.adjust(route)
     n = sum([len(line) for line in route])
     key = np.zeros(n)
     keyInt = np.array(range(n))
     keyDec = np.zeros(n)
     for k in range(len(route)):
-        r = np.random.uniform(size=len(route[k]))
+        r = rng.uniform(size=len(route[k]))
         r.sort()
         key[route[k]] = r + k
         keyInt[route[k]] = k
@@ -225,43 +832,86 @@ def encode(route):
     return key, keyInt, keyDec
 
 
+# true if keys a and b put their clients on the same shifts in the same order
+def same_structure(a, aInt, b, bInt):
+    return np.array_equal(aInt, bInt) and \
+        np.array_equal(np.argsort(a, kind='stable'), np.argsort(b, kind='stable'))
+
+
+# keeps keys below the next shift index after rounding to a narrow dtype
+def fit_keys(keys, keyInts):
+    if keys.dtype.kind == 'f' and keys.dtype != np.float64:
+        upper = np.nextafter((keyInts + 1).astype(keys.dtype), keys.dtype.type(0))
+        np.minimum(keys, upper, out=keys)
+
+
 def decode(key, instance):
-    v = instance.v
-    enum = list(enumerate(key))
-    enum.sort(key=operator.itemgetter(1))
-    route = [[] for k in range(v)]
-    for r in range(len(key)):
-        route[int(enum[r][1])].append(enum[r][0] + 1)
-    return route
+    return decode_shifts(key, key_shifts(key), np.arange(instance.v))
 
 # ------------------------------------------------------------------------------
 # support functions for buildTree method
 # ------------------------------------------------------------------------------
 
 
-def distance(i, j, individuals, instance, deptype):
-    if deptype == 1:
-        return 1-measures.binomial_depcy(i, j, individuals, instance, weight=2/3)
-    elif deptype == 2:
-        return 1-measures.inner_depcy(i, j, individuals, measures.same_shift(i, j, individuals))
-    elif deptype == 3:
-        return measures.random_depcy()
+# returns row and column indices of condensed distance positions a, ..., b-1
+def condensed_pairs(a, b, n):
+    k = np.arange(a, b, dtype=np.int64)
+    i = n - 2 - np.floor(np.sqrt(-8*k + 4*n*(n-1) - 7)/2 - 0.5).astype(np.int64)
+    j = k + i + 1 - n*(n-1)//2 + (n-i)*((n-i)-1)//2
+    return i, j
 
 
-def distances(individuals, instance, deptype):
-    d = []
+# number of pairs per block such that the block temporaries fit in memlimit
+def block_size(population, instance, memlimit):
     n = instance.n-1
-    for i in range(n):
-        for j in range(i + 1, n):
-            d.append(distance(i, j, individuals, instance, deptype))
-    return d
+    m = n*(n-1)//2
+    if memlimit is None:
+        return max(m, 1)
+    per_pair = measures.block_bytes(population.size, instance.v)
+    return int(min(max(memlimit // per_pair, 1), max(m, 1)))
 
 
-def getset(tree, i, n):
-    if i < n:
-        return [i]
-    else:
-        return getset(tree, int(tree[i - n, 0]), n) + getset(tree, int(tree[i - n, 1]), n)
+# writes condensed distance matrix into out (allocated if None), computed
+# in blocks of consecutive pairs to stay below memlimit bytes of temporaries
+def distances(population, instance, deptype, out=None, memlimit=None):
+    n = instance.n-1
+    m = n*(n-1)//2
+    if deptype not in DEPTYPES:
+        raise ValueError('unknown deptype %r' % (deptype,))
+    if out is None:
+        out = np.empty(m)
+    if deptype == 3:
+        out[:] = measures.random_depcy()
+        return out
+    block = block_size(population, instance, memlimit)
+    for a in range(0, m, block):
+        b = min(a + block, m)
+        I, J = condensed_pairs(a, b, n)
+        if deptype == 1:
+            out[a:b] = 1-measures.binomial_depcy_block(
+                I, J, population, instance, weight=2/3)
+        elif deptype == 2:
+            out[a:b] = 1-measures.inner_depcy_block(I, J, population)[1]
+        elif deptype == 4:
+            out[a:b] = 1-measures.static_depcy_block(I, J, instance)
+    return out
+
+
+# peak resident memory of this process in bytes
+def peak_memory():
+    import resource
+    import sys
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == 'darwin' else 1024*rss
+
+
+# returns all FOS elements of tree: leaves 0, ..., n-1 and one merged
+# cluster per row of the linkage matrix
+def fos_sets(tree, n):
+    sets = [[i] for i in range(n)]
+    for a, b in tree[:, :2].astype(np.int64).tolist():
+        sets.append(sets[a] + sets[b])
+    return [np.array(FOS) for FOS in sets]
 
 
 if __name__ == "__main__":
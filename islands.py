@@ -0,0 +1,146 @@
+import multiprocessing as mp
+import queue
+import time
+import datetime
+import numpy as np
+import gomea
+
+"""
+module contains island model for gomea
+
+main function is island_solve:
+    runs independent populations (islands) of gomea in separate processes
+    islands (integer or list of dicts): number of islands, or one dict of
+        gomea specs per island (e.g. a different deptype or population size)
+    interval (integer): number of generations between migrations
+    remaining **params are shared specs for all islands (see gomea.specs)
+    returns result dictionary of gomea_solve for best island, extended with
+    a summary per island and the islands that failed (error per island)
+
+migration:
+    islands form a ring, every interval generations each island sends its
+    elitist to the next island and takes in all migrants waiting in its inbox
+    a migrant replaces the worst individual of the receiving population
+    if it is better, its route is re-encoded in the keys of the receiving
+    island (islands may use different encoding or keytype), migration never
+    blocks a (faster) island
+"""
+
+# ------------------------------------------------------------------------------
+# migration channel
+# ------------------------------------------------------------------------------
+
+
+def migration(inbox, outbox, interval):
+    def callback(pop, g):
+        if (g + 1) % interval == 0:
+            outbox.put((pop.eliteKey, pop.eliteKeyInt, pop.eliteScore))
+        while True:
+            try:
+                key, keyInt, score = inbox.get_nowait()
+            except queue.Empty:
+                break
+            pop.immigrate(key, keyInt, score)
+        return False
+    return callback
+
+
+def run_island(idx, instance, params, seed, inbox, outbox, results, interval):
+    # migrants are disposable: do not wait for a finished neighbour to read
+    outbox.cancel_join_thread()
+    callback = migration(inbox, outbox, interval)
+    try:
+        res = gomea.gomea_solve(instance, callback=callback, seed=seed,
+                                **params)
+    except Exception as e:
+        results.put({'island': idx, 'error': repr(e)})
+        raise
+    res['island'] = idx
+    results.put(res)
+
+
+# collects one result (or error record) per island, an island that exits
+# without posting one (killed, crashed) is recorded as failed
+def collect(results, procs, timeout=0.5):
+    res = {}
+    while len(res) < len(procs):
+        try:
+            r = results.get(timeout=timeout)
+            res[r['island']] = r
+            continue
+        except queue.Empty:
+            pass
+        dead = [i for i, proc in enumerate(procs)
+                if i not in res and proc.exitcode is not None]
+        # a process flushes its results before it exits
+        while True:
+            try:
+                r = results.get_nowait()
+            except queue.Empty:
+                break
+            res[r['island']] = r
+        for i in dead:
+            if i not in res:
+                res[i] = {'island': i,
+                          'error': 'exited with code %d' % procs[i].exitcode}
+    return [res[i] for i in range(len(procs))]
+
+# ------------------------------------------------------------------------------
+# main function
+# ------------------------------------------------------------------------------
+
+
+def island_solve(instance, islands=4, interval=2, **params):
+    if isinstance(islands, int):
+        islands = [{} for i in range(islands)]
+    N = len(islands)
+    configs = [dict(params, **island) for island in islands]
+    seeds = np.random.randint(2**31 - 1, size=N)
+
+    inboxes = [mp.Queue() for i in range(N)]
+    results = mp.Queue()
+    procs = []
+    t0 = time.time()
+    for i in range(N):
+        proc = mp.Process(target=run_island,
+                          args=(i, instance, configs[i], seeds[i], inboxes[i],
+                                inboxes[(i + 1) % N], results, interval))
+        proc.start()
+        procs.append(proc)
+
+    # collect results before joining, a full results pipe blocks the islands
+    res = collect(results, procs)
+    for proc in procs:
+        proc.join()
+    t1 = time.time()
+
+    failed = [r for r in res if 'error' in r]
+    res = [r for r in res if 'error' not in r]
+    for r in failed:
+        print('island', r['island'], 'failed:', r['error'])
+    if len(res) == 0:
+        raise RuntimeError('all islands failed: %s' %
+                           [r['error'] for r in failed])
+    best = min(res, key=lambda r: r['score'])
+    print('best island:', best['island'], 'score:', best['score'])
+    print('total wall time:', str(datetime.timedelta(seconds=t1-t0)))
+
+    result = dict(best)
+    result['wall_time'] = t1 - t0
+    result['islands'] = [{'island': r['island'],
+                          'params': r['params'],
+                          'score': r['score'],
+                          'gen_count': r['gen_count'],
+                          'progress': r['progress']} for r in res]
+    result['failed'] = failed
+    return result
+
+
+if __name__ == "__main__":
+    import instance
+    ins = instance.Instance(30, 4)
+    res = island_solve(ins, islands=[{'deptype': 1}, {'deptype': 2},
+                                     {'deptype': 1, 'population': 100},
+                                     {'deptype': 3}],
+                       interval=2, generations=5)
+    print(res['score'], [isl['score'] for isl in res['islands']])
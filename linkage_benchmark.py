@@ -0,0 +1,43 @@
+import sys
+import numpy as np
+import instance
+import gomea
+
+'''
+linkage benchmark: score, total time and linkage tree time of the learned
+dependency measures (deptype 1 and 2) against the static measure (deptype 4,
+plain and blended with deptype 1) on random instances, mean over seeds
+'''
+
+CONFIGS = [('extended (1)', {'deptype': 1}),
+           ('standard (2)', {'deptype': 2}),
+           ('static (4)', {'deptype': 4}),
+           ('static (4) blend 0.5', {'deptype': 4, 'blend': 0.5})]
+SIZES = [(40, 5), (80, 8)]
+
+
+def run(ins, params, seed):
+    np.random.seed(seed)
+    res = gomea.gomea_solve(ins, **params)
+    return res['score'], res['time_track'][-1], res['tree_time']
+
+
+def main(seeds=3, generations=10):
+    rows = []
+    for n, v in SIZES:
+        np.random.seed(n)
+        ins = instance.Instance(n, v)
+        for name, config in CONFIGS:
+            out = np.array([run(ins, dict(config, generations=generations,
+                                          stop=generations), seed)
+                            for seed in range(seeds)])
+            rows.append((n, v, name) + tuple(out.mean(axis=0)))
+    print('%-5s %-3s %-22s %10s %10s %10s' %
+          ('n', 'v', 'linkage', 'score', 'time [s]', 'tree [s]'))
+    for row in rows:
+        print('%-5d %-3d %-22s %10.1f %10.3f %10.3f' % row)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,8 @@
 import numpy as np
-from scipy.stats import binom
 
 '''
 module contains dependency measures and methods that help build them
+(scipy.stats is imported on first use)
 '''
 
 #==============================================================================
@@ -25,77 +25,48 @@ def same_shift_prob(i,j,instance):
     return np.dot(pi,pj)
 
 #returns number of same shifts scheduling for indices i and j
-def same_shift(i,j,individuals):
-    size = len(individuals)
-    x = 0
-    for k in range(size):
-        ri = individuals[k].keyInt[i]
-        rj = individuals[k].keyInt[j]
-        if ri == rj:
-            x += 1
-    return x
+def same_shift(i,j,population):
+    keyInts = population.keyInts
+    return np.count_nonzero(keyInts[:,i] == keyInts[:,j])
 
 #returns joint/marginal distributions of shift distribution for i and j
-def shift_distribution(i,j,individuals,instance):
-    size = len(individuals)
+def shift_distribution(i,j,population,instance):
+    size = population.size
     v = instance.v
-    bins = np.zeros((v,v))
-    for k in range(size):
-        ri = individuals[k].keyInt[i]
-        rj = individuals[k].keyInt[j]
-        bins[(ri, rj)] += 1
+    keyInts = population.keyInts
+    cells = keyInts[:,i].astype(np.intp)*v + keyInts[:,j]
+    bins = np.bincount(cells, minlength=v*v).reshape((v,v))
     xyjoint = bins/size
-    xmarginal = np.array([np.sum(xyjoint[k,:]) for k in range(v)])
-    ymarginal = np.array([np.sum(xyjoint[:,l]) for l in range(v)])
+    xmarginal = xyjoint.sum(axis=1)
+    ymarginal = xyjoint.sum(axis=0)
     return xyjoint, xmarginal, ymarginal
 
 #returns number of times j follows i if on same shift       
-def relative_order(i,j,individuals):
-    size = len(individuals)
-    x = 0
-    for k in range(size):
-        si = individuals[k].keyInt[i]
-        sj = individuals[k].keyInt[j]
-        ri = individuals[k].key[i]
-        rj = individuals[k].key[j]
-        if si == sj and ri < rj:
-            x += 1
-    return x
+def relative_order(i,j,population):
+    keyInts = population.keyInts
+    keys = population.keys
+    same = keyInts[:,i] == keyInts[:,j]
+    return np.count_nonzero(same & (keys[:,i] < keys[:,j]))
 
 #returns total sum of squared differences for random keys on index i and j if on same shift
-def relative_adjacency(i,j,individuals):
-    size = len(individuals)
-    sqsum = 0
-    for k in range(size):
-        ri = individuals[k].keyInt[i]
-        rj = individuals[k].keyInt[j]
-        if ri == rj:
-            sqsum += (individuals[k].key[i]-individuals[k].key[j])**2
-    return sqsum
+def relative_adjacency(i,j,population):
+    keyInts = population.keyInts
+    keys = population.keys
+    same = keyInts[:,i] == keyInts[:,j]
+    diff = (keys[same,i] - keys[same,j])/population.keyScale
+    return np.dot(diff,diff)
 
 #==============================================================================
 #statistical measures
 #==============================================================================
 
-binom_cdf_storage = {}  # a bit hacky, but this stores binom.cdf's
+#scalar reference of binomial_block
 def binomial(x,size,p):
+    from scipy.stats import binom
 
     E = size*p
-
-    # retrieve or determine numerator
-    if (x, size, p) in binom_cdf_storage:
-        num = binom_cdf_storage[(x, size, p)]
-    else:
-        num = binom.cdf(x, size, p)
-        binom_cdf_storage[(x, size, p)] = num  # store it for re-use
-
-    # retrieve or determine denominator
-    if (E, size, p) in binom_cdf_storage:
-        denom = binom_cdf_storage[(E, size, p)]
-    else:
-        denom = binom.cdf(E, size, p)
-        binom_cdf_storage[(E, size, p)] = denom  # store it for re-use
-
+    num = binom.cdf(x, size, p)
+    denom = binom.cdf(E, size, p)
     if x <= E:
         return num/denom
     else:
@@ -132,26 +103,124 @@ def mutual_info(xyjoint,xmarginal,ymarginal,normalizer):
 def random_depcy():
     return 1
 
-def inner_depcy(i,j,individuals,x):
+def inner_depcy(i,j,population,x):
     if x == 0:
         return 0
     else:
-        p = relative_order(i,j,individuals)/x
-        avg_sqdiff = relative_adjacency(i,j,individuals)/x
+        p = relative_order(i,j,population)/x
+        avg_sqdiff = relative_adjacency(i,j,population)/x
         return (1-entropy(p))*(1-avg_sqdiff)    
 
-def binomial_depcy(i,j,individuals,instance,weight):
-    size = len(individuals)
-    x = same_shift(i,j,individuals)
+#scalar reference of binomial_depcy_block for one pair (gomea uses the block
+#version only)
+def binomial_depcy(i,j,population,instance,weight):
+    size = population.size
+    x = same_shift(i,j,population)
     p = same_shift_prob(i,j,instance)
     E = size*p
     bi = 1-binomial(x,size,p)
-    xyjoint, xmarginal, ymarginal = shift_distribution(i,j,individuals,instance)
+    xyjoint, xmarginal, ymarginal = shift_distribution(i,j,population,instance)
     normalizer = min(len(instance.feasibleShiftsForClients[i]),
                      len(instance.feasibleShiftsForClients[j]))
     mi = mutual_info(xyjoint,xmarginal,ymarginal,normalizer)
-    inner = inner_depcy(i,j,individuals,x)
+    inner = inner_depcy(i,j,population,x)
     if x <= E:
         return bi*(weight+(1-weight)*mi)
     else:
-        return bi*(weight+(1-weight)*inner)   
\ No newline at end of file
+        return bi*(weight+(1-weight)*inner)   
+
+#==============================================================================
+#vectorized dependency measures for blocks of index pairs (I[m], J[m])
+#==============================================================================
+
+#approximate working memory in bytes per pair of a block
+def block_bytes(size,v):
+    return 40*size + 24*v*v
+
+#returns probability that I[m] and J[m] are on the same shift in a random schedule
+def same_shift_prob_block(I,J,instance):
+    Q = np.asarray(instance.Q)[:instance.n-1] == 1
+    F = Q/Q.sum(axis=1, keepdims=True)
+    return np.einsum('mk,mk->m', F[I], F[J])
+
+def entropy_block(p):
+    h = np.zeros(len(p))
+    mid = (p > 0) & (p < 1)
+    q = p[mid]
+    h[mid] = -(q*np.log2(q)+(1-q)*np.log2(1-q))
+    return h
+
+def binomial_block(x,size,p):
+    from scipy.stats import binom
+    E = size*p
+    num = binom.cdf(x, size, p)
+    denom = binom.cdf(E, size, p)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(x <= E, num/denom, (1 - num)/(1 - denom))
+
+#returns same shift counts, inner dependency and shift assignments for the pairs
+def inner_depcy_block(I,J,population):
+    keyInts = population.keyInts
+    keys = population.keys
+    sI = keyInts[:,I]
+    sJ = keyInts[:,J]
+    same = sI == sJ
+    x = same.sum(axis=0)
+    kI = keys[:,I]
+    kJ = keys[:,J]
+    order = (same & (kI < kJ)).sum(axis=0)
+    kI = (kI - kJ)/population.keyScale
+    kI *= kI
+    sqsum = np.where(same, kI, 0).sum(axis=0)
+    inner = np.zeros(len(I))
+    pos = x > 0
+    xp = x[pos]
+    inner[pos] = (1-entropy_block(order[pos]/xp))*(1-sqsum[pos]/xp)
+    return x, inner, sI, sJ
+
+#mutual information of shift assignments, normalized by log of the smallest
+#number of feasible shifts (zero if one of the clients has a single shift)
+def mutual_info_block(sI,sJ,size,v,normalizer):
+    m = sI.shape[1]
+    cells = sI.astype(np.intp)*v + sJ + np.arange(m)*v*v
+    xyjoint = np.bincount(cells.ravel(), minlength=m*v*v).reshape((m,v,v))/size
+    xmarginal = xyjoint.sum(axis=2)
+    ymarginal = xyjoint.sum(axis=1)
+    outer = xmarginal[:,:,None]*ymarginal[:,None,:]
+    terms = np.zeros_like(xyjoint)
+    pos = xyjoint > 0
+    ratio = xyjoint[pos]/outer[pos]
+    terms[pos] = np.where(ratio != 1, xyjoint[pos]*np.log(ratio), 0)
+    mi = terms.sum(axis=(1,2))
+    normalizerTerm = np.log(np.maximum(normalizer, 2))
+    return np.where(normalizer > 1, mi/normalizerTerm, 0)
+
+#static dependency from instance features only: share of common feasible
+#shifts (Q) times the mean of travel time closeness (d) and time window
+#closeness (tw), closeness decays with the mean travel time and mean window
+#length, overlapping windows are closest
+def static_depcy_block(I,J,instance):
+    n = instance.n
+    Q = np.asarray(instance.Q)[:n-1] == 1
+    shared = (Q[I] & Q[J]).sum(axis=1)
+    union = (Q[I] | Q[J]).sum(axis=1)
+    jaccard = shared/np.maximum(union,1)
+    D = np.asarray(instance.d, dtype=np.float64)[1:,1:]
+    travel = (D[I,J] + D[J,I])/2
+    near = np.exp(-travel/max(D.mean(),1e-9))
+    tw = np.array(instance.tw[1:n], dtype=np.float64)
+    gap = np.maximum(tw[I,0],tw[J,0]) - np.minimum(tw[I,1],tw[J,1])
+    length = max((tw[:,1]-tw[:,0]).mean(),1e-9)
+    timing = np.exp(-np.maximum(gap,0)/length)
+    return jaccard*(near+timing)/2
+
+def binomial_depcy_block(I,J,population,instance,weight):
+    size = population.size
+    x, inner, sI, sJ = inner_depcy_block(I,J,population)
+    p = same_shift_prob_block(I,J,instance)
+    E = size*p
+    bi = 1-binomial_block(x,size,p)
+    nfeas = (np.asarray(instance.Q)[:instance.n-1] == 1).sum(axis=1)
+    normalizer = np.minimum(nfeas[I], nfeas[J])
+    mi = mutual_info_block(sI,sJ,size,instance.v,normalizer)
+    return bi*(weight+(1-weight)*np.where(x <= E, mi, inner))
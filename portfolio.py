@@ -0,0 +1,194 @@
+import json
+import multiprocessing as mp
+import queue
+import time
+import datetime
+import numpy as np
+import gomea
+import distributed
+
+"""
+module contains racing portfolio of gomea configurations
+
+main function is portfolio_solve:
+    runs one gomea_solve per configuration concurrently in separate processes
+    and cancels the others as soon as one configuration wins the race
+    configs (list of dicts): gomea specs per configuration (e.g. deptype,
+        population, init), default is PORTFOLIO
+    target (float or None): a configuration reaching this score wins
+    lead (float): a configuration wins once its best score is lower than the
+        best score of every other configuration by this fraction, after all
+        configurations finished warmup generations
+    warmup (integer): generations before the lead rule applies
+    record (path or None): json lines file the winning configuration is
+        appended to (instance hash, configuration, score, time)
+    remaining **params are shared specs for all configurations
+    returns result dictionary of gomea_solve of the winner, extended with
+    the race per configuration (best score over time, cancelled or not)
+
+a configuration that finishes on its own is a candidate too: if no rule
+fired the best finished configuration wins, configurations that fail (raise
+or exit without result) never win
+"""
+
+PORTFOLIO = [{'deptype': 1}, {'deptype': 2}, {'deptype': 3},
+             {'deptype': 2, 'init': 'insertion'}]
+
+# ------------------------------------------------------------------------------
+# racing processes
+# ------------------------------------------------------------------------------
+
+
+def run_config(idx, instance, params, seed, cancel, reports, results):
+    t0 = time.time()
+
+    def callback(pop, g):
+        reports.put((idx, g, float(pop.eliteScore), time.time() - t0))
+        return cancel.is_set()
+
+    try:
+        res = gomea.gomea_solve(instance, callback=callback, seed=seed,
+                                **params)
+    except Exception as e:
+        results.put({'config': idx, 'error': repr(e)})
+        raise
+    res['config'] = idx
+    res['cancelled'] = cancel.is_set()
+    results.put(res)
+
+
+# returns index of the winning configuration, or None
+def winner(best, gens, target, lead, warmup):
+    scores = np.array([np.inf if b is None else b for b in best])
+    first = int(np.argmin(scores))
+    if target is not None and scores[first] <= target:
+        return first
+    if len(scores) > 1 and min(gens) >= warmup:
+        others = np.delete(scores, first)
+        if scores[first] < (1 - lead)*others.min():
+            return first
+    return None
+
+# ------------------------------------------------------------------------------
+# main function
+# ------------------------------------------------------------------------------
+
+
+def portfolio_solve(instance, configs=None, target=None, lead=0.05, warmup=3,
+                    record=None, **params):
+    if configs is None:
+        configs = PORTFOLIO
+    N = len(configs)
+    specs = [dict(params, **config) for config in configs]
+    seeds = np.random.randint(2**31 - 1, size=N)
+
+    cancels = [mp.Event() for i in range(N)]
+    reports = mp.Queue()
+    results = mp.Queue()
+    procs = []
+    t0 = time.time()
+    for i in range(N):
+        proc = mp.Process(target=run_config,
+                          args=(i, instance, specs[i], seeds[i], cancels[i],
+                                reports, results))
+        proc.start()
+        procs.append(proc)
+
+    race = [[] for i in range(N)]
+    best = [None for i in range(N)]
+    gens = [0 for i in range(N)]
+    won = None
+    res = {}
+
+    def finish(r):
+        i = r['config']
+        res[i] = r
+        # a finished configuration does not hold back the lead rule, a failed
+        # one is out of the race
+        gens[i] = np.inf
+        if 'error' in r:
+            best[i] = None
+            print('configuration', configs[i], 'failed:', r['error'])
+
+    while len(res) < N:
+        try:
+            finish(results.get_nowait())
+            continue
+        except queue.Empty:
+            pass
+        try:
+            i, g, score, t = reports.get(timeout=0.1)
+        except queue.Empty:
+            dead = [i for i, proc in enumerate(procs)
+                    if i not in res and proc.exitcode is not None]
+            # a process flushes its results before it exits
+            while True:
+                try:
+                    finish(results.get_nowait())
+                except queue.Empty:
+                    break
+            for i in dead:
+                if i not in res:
+                    finish({'config': i, 'error': 'exited with code %d' %
+                            procs[i].exitcode})
+            continue
+        race[i].append((g, score, t))
+        if i in res and 'error' in res[i]:
+            continue
+        best[i] = score
+        gens[i] = max(gens[i], g + 1)
+        if won is None:
+            won = winner(best, gens, target, lead, warmup)
+            if won is not None:
+                for j in range(N):
+                    if j != won or (target is not None and
+                                    best[won] <= target):
+                        cancels[j].set()
+    for proc in procs:
+        proc.join()
+    while True:
+        try:
+            i, g, score, t = reports.get_nowait()
+        except queue.Empty:
+            break
+        race[i].append((g, score, t))
+    t1 = time.time()
+
+    done = [i for i in range(N) if 'error' not in res[i]]
+    if len(done) == 0:
+        raise RuntimeError('all configurations failed: %s' %
+                           [res[i]['error'] for i in range(N)])
+    if won is None or won not in done:
+        won = min(done, key=lambda i: res[i]['score'])
+    print('winning configuration:', configs[won], 'score:', res[won]['score'])
+    print('total wall time:', str(datetime.timedelta(seconds=t1-t0)))
+
+    if record is not None:
+        with open(record, 'a') as file:
+            file.write(json.dumps({'instance': distributed.instance_key(instance),
+                                   'n': instance.n, 'v': instance.v,
+                                   'config': configs[won],
+                                   'params': params,
+                                   'score': float(res[won]['score']),
+                                   'time': t1 - t0,
+                                   'date': datetime.datetime.now().isoformat()},
+                                  default=str) + '\n')
+
+    result = dict(res[won])
+    result['winner'] = won
+    result['wall_time'] = t1 - t0
+    result['race'] = [{'config': configs[i],
+                       'score': res[i].get('score'),
+                       'gen_count': res[i].get('gen_count'),
+                       'cancelled': res[i].get('cancelled', False),
+                       'error': res[i].get('error'),
+                       'best_over_time': race[i]} for i in range(N)]
+    return result
+
+
+if __name__ == "__main__":
+    import instance
+    ins = instance.Instance(40, 5)
+    res = portfolio_solve(ins, lead=0.05, warmup=2, generations=10)
+    for r in res['race']:
+        print(r['config'], r['score'], r['gen_count'], r['cancelled'])
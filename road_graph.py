@@ -0,0 +1,183 @@
+import os
+import json
+import xml.etree.ElementTree as ET
+import numpy as np
+
+'''
+contains compact road graph format and many-to-many shortest path queries
+
+convert_graphml reads a GraphML road network (as saved by osmnx) once and
+writes it to a directory of .npy arrays in CSR layout:
+    node_ids (N): osm id per node
+    x, y (N): longitude and latitude per node
+    indptr (N+1), indices (E), weights (E): outgoing edges of node i are
+        indices[indptr[i]:indptr[i+1]] with weights (edge attribute, default
+        length in meters) at the same positions, parallel edges keep the
+        lowest weight
+load_graph maps these arrays into memory (np.load with mmap_mode), so a
+city-sized network loads in milliseconds instead of parsing xml
+
+main function is travel_matrix: same layout as travel_matrix.travel_matrix,
+coordinates are snapped to their nearest node and all shortest paths are
+computed with one multi-source dijkstra per block of sources
+(scipy.sparse.csgraph, imported on first use), raises ValueError if a pair
+of clients has no path
+'''
+
+FORMAT_VERSION = 1
+ARRAYS = ['node_ids', 'x', 'y', 'indptr', 'indices', 'weights']
+
+# ------------------------------------------------------------------------------
+# conversion
+# ------------------------------------------------------------------------------
+
+
+def read_graphml(path, weight='length'):
+    ns = '{http://graphml.graphdrawing.org/xmlns}'
+    keys = {}
+    node_ids, x, y = [], [], []
+    src, dst, w = [], [], []
+    directed = True
+    for event, elem in ET.iterparse(path, events=('start', 'end')):
+        tag = elem.tag.replace(ns, '')
+        if event == 'start':
+            if tag == 'graph':
+                directed = elem.get('edgedefault', 'directed') == 'directed'
+            continue
+        if tag == 'key':
+            keys[(elem.get('for'), elem.get('attr.name'))] = elem.get('id')
+        elif tag == 'node':
+            data = {d.get('key'): d.text for d in elem.findall(ns + 'data')}
+            node_ids.append(elem.get('id'))
+            x.append(float(data[keys[('node', 'x')]]))
+            y.append(float(data[keys[('node', 'y')]]))
+            elem.clear()
+        elif tag == 'edge':
+            data = {d.get('key'): d.text for d in elem.findall(ns + 'data')}
+            src.append(elem.get('source'))
+            dst.append(elem.get('target'))
+            w.append(float(data[keys[('edge', weight)]]))
+            elem.clear()
+    return node_ids, np.array(x), np.array(y), src, dst, np.array(w), directed
+
+
+def convert_graphml(path, out=None, weight='length', dtype=np.float64):
+    if out is None:
+        out = os.path.splitext(path)[0] + '_csr'
+    node_ids, x, y, src, dst, w, directed = read_graphml(path, weight)
+    index = {node: i for i, node in enumerate(node_ids)}
+    src = np.array([index[s] for s in src], dtype=np.int64)
+    dst = np.array([index[t] for t in dst], dtype=np.int64)
+    if not directed:
+        src, dst = np.concatenate((src, dst)), np.concatenate((dst, src))
+        w = np.concatenate((w, w))
+    N = len(node_ids)
+
+    # sort on (source, target, weight) and keep the lightest parallel edge
+    order = np.lexsort((w, dst, src))
+    src, dst, w = src[order], dst[order], w[order]
+    first = np.ones(len(src), dtype=bool)
+    first[1:] = (src[1:] != src[:-1]) | (dst[1:] != dst[:-1])
+    src, dst, w = src[first], dst[first], w[first]
+    indptr = np.zeros(N + 1, dtype=np.int64)
+    np.cumsum(np.bincount(src, minlength=N), out=indptr[1:])
+
+    itype = np.int32 if N < 2**31 else np.int64
+    os.makedirs(out, exist_ok=True)
+    arrays = {'node_ids': np.array([int(i) for i in node_ids], dtype=np.int64),
+              'x': x, 'y': y, 'indptr': indptr,
+              'indices': dst.astype(itype), 'weights': w.astype(dtype)}
+    for name in ARRAYS:
+        np.save(os.path.join(out, name + '.npy'), arrays[name])
+    with open(os.path.join(out, 'meta.json'), 'w') as file:
+        json.dump({'version': FORMAT_VERSION, 'source': os.path.abspath(path),
+                   'weight': weight, 'nodes': N, 'edges': int(len(dst))}, file)
+    return out
+
+
+# returns directory of the converted graph, converts path (graphml) if the
+# conversion is missing or older than the graphml file
+def cached(path, weight='length'):
+    out = os.path.splitext(path)[0] + '_csr'
+    meta = os.path.join(out, 'meta.json')
+    if not os.path.exists(meta) or \
+            os.path.getmtime(meta) < os.path.getmtime(path):
+        convert_graphml(path, out, weight)
+    return out
+
+# ------------------------------------------------------------------------------
+# queries
+# ------------------------------------------------------------------------------
+
+
+class RoadGraph:
+    def __init__(self, directory):
+        for name in ARRAYS:
+            setattr(self, name, np.load(os.path.join(directory, name + '.npy'),
+                                        mmap_mode='r'))
+        self.size = len(self.x)
+        self.matrix = None
+
+    def csr(self):
+        if self.matrix is None:
+            from scipy.sparse import csr_matrix
+            self.matrix = csr_matrix((self.weights, self.indices, self.indptr),
+                                     shape=(self.size, self.size))
+        return self.matrix
+
+
+def load_graph(directory):
+    return RoadGraph(directory)
+
+
+# returns index of nearest node per coordinate (equirectangular distance),
+# nodes are scanned in chunks to bound memory
+def nearest_nodes(graph, lat, lon, chunk=2**20):
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    scale = np.cos(lat.mean())
+    best = np.full(len(lat), np.inf)
+    node = np.zeros(len(lat), dtype=np.int64)
+    for a in range(0, graph.size, max(chunk//max(len(lat), 1), 1)):
+        b = min(a + max(chunk//max(len(lat), 1), 1), graph.size)
+        ny = np.radians(np.asarray(graph.y[a:b]))
+        nx = np.radians(np.asarray(graph.x[a:b]))
+        d = (lat[:, None] - ny)**2 + (scale*(lon[:, None] - nx))**2
+        arg = np.argmin(d, axis=1)
+        value = d[np.arange(len(lat)), arg]
+        better = value < best
+        best[better] = value[better]
+        node[better] = a + arg[better]
+    return node
+
+
+# returns len(sources) x len(targets) shortest path weights between nodes,
+# dijkstra runs for blocks of unique sources (block x N distances in memory)
+def shortest_paths(graph, sources, targets, block=256):
+    from scipy.sparse.csgraph import dijkstra
+    G = graph.csr()
+    sources = np.asarray(sources)
+    targets = np.asarray(targets)
+    unique, inverse = np.unique(sources, return_inverse=True)
+    out = np.empty((len(unique), len(targets)))
+    for a in range(0, len(unique), block):
+        dist = dijkstra(G, directed=True, indices=unique[a:a+block])
+        out[a:a+block] = dist[:, targets]
+    return out[inverse]
+
+
+def travel_matrix(size, lat, lon, directory, silent=True):
+    graph = load_graph(directory)
+    nodes = nearest_nodes(graph, np.asarray(lat)[:size], np.asarray(lon)[:size])
+    d = np.zeros((size+1, size+1))
+    d[1:, 1:] = shortest_paths(graph, nodes, nodes)
+    # a missing path would score every schedule using it as inf
+    missing = np.argwhere(np.isinf(d))
+    if len(missing) > 0:
+        raise ValueError('no path between %d client pairs (client ids of '
+                         'travel matrix), e.g. %s' %
+                         (len(missing), [tuple(int(c) for c in pair)
+                                         for pair in missing[:10]]))
+    if not silent:
+        print('%d locations on %d nodes' % (size, graph.size))
+    return d.tolist()
@@ -14,6 +14,7 @@ input schedule class:
         - sublist[0] and sublist[-1] is start- and return time at base
     
     if set to None then attributes are generated automatically
+    rng (np.random.Generator or None): random generator for a generated route
     
 contains methods to evaluate schedule:
     dist: total distance travelled
@@ -24,7 +25,7 @@ contains methods to evaluate schedule:
 
 
 class Schedule:
-    def __init__(self, instance, route=None, arrival=None):
+    def __init__(self, instance, route=None, arrival=None, rng=None):
         self.n = instance.n
         self.v = instance.v
         self.d = instance.d
@@ -33,13 +34,14 @@ class Schedule:
         self.Q = instance.Q
         self.u = instance.u
         self.ss = instance.ss
+        self.rng = rng
 
         self.route = self.load_route(route)
         self.arrival = self.load_arrival(self.route, arrival)
 
     def load_route(self, route):
         if route == None:
-            return random_route(self.n, self.v, self.Q)
+            return random_route(self.n, self.v, self.Q, self.rng)
         else:
             return route
 
@@ -87,6 +89,20 @@ class Schedule:
         return wx*self.distance() + wy*self.shift_overtime() + wz*self.waiting_time()
 
 
+# score of a (partial) evaluation that reached its cutoff
+REJECTED = np.inf
+
+
+# returns rng if it is a generator, else a generator seeded with rng, or
+# from the global numpy random state if rng is None (np.random.seed keeps
+# runs reproducible)
+def generator(rng=None):
+    if isinstance(rng, np.random.Generator):
+        return rng
+    if rng is None:
+        rng = np.random.randint(2**63 - 1, dtype=np.int64)
+    return np.random.default_rng(rng)
+
 # ------------------------------------------------------------------------------
 # support functions to generate random feasible schedule
 # ------------------------------------------------------------------------------
@@ -100,24 +116,96 @@ def get_feasible_clients(k, clients, Q):
     return feasible
 
 
-def random_route(n, v, Q):
-    clients = list(range(n-1))
-    shifts = list(range(v))
+def random_route(n, v, Q, rng=None):
+    rng = generator(rng)
+    Q = np.asarray(Q)
+    # feasible clients per shift, clients assigned elsewhere are dropped lazily
+    feasible = [np.flatnonzero(Q[:n-1, k] == 1).tolist() for k in range(v)]
+    assigned = [False for i in range(n-1)]
     adjshifts = list(range(v))
-    route = [[] for k in shifts]
+    route = [[] for k in range(v)]
 
-    while len(clients) > 0:
-        getclients = [get_feasible_clients(k, clients, Q) for k in shifts]
-        randomshift = np.random.choice(adjshifts)
-        if len(getclients[randomshift]) == 0:
+    left = n-1
+    while left > 0:
+        randomshift = adjshifts[rng.integers(len(adjshifts))]
+        clients = feasible[randomshift]
+        randomclient = None
+        while len(clients) > 0:
+            j = rng.integers(len(clients))
+            i = clients[j]
+            clients[j] = clients[-1]
+            clients.pop()
+            if not assigned[i]:
+                randomclient = i
+                break
+        if randomclient is None:
             adjshifts.remove(randomshift)
             continue
-        randomclient = np.random.choice(getclients[randomshift])
+        assigned[randomclient] = True
         route[randomshift].append(randomclient+1)
-        clients.remove(randomclient)
+        left -= 1
 
     return route
 
+# ------------------------------------------------------------------------------
+# time window aware construction of schedules
+# ------------------------------------------------------------------------------
+
+# builds size routes at once: clients in order of time window start (with
+# jitter as fraction of the window length) are appended to a qualified
+# shift, drawn among the shifts whose extra score is within alpha of the
+# cheapest (relative to the range from cheapest to most expensive)
+
+
+def insertion_routes(instance, size, alpha=0.2, jitter=1.0, rng=None):
+    rng = generator(rng)
+    n, v = instance.n, instance.v
+    D = np.asarray(instance.d, dtype=np.float64)
+    p = np.asarray(instance.p, dtype=np.float64)
+    Q = np.asarray(instance.Q)[:n-1] == 1
+    u = np.asarray(instance.u, dtype=np.float64)
+    ss = np.asarray(instance.ss, dtype=np.float64)
+    tw = np.array([(0, 0)] + list(instance.tw[1:n]), dtype=np.float64)
+
+    length = tw[1:, 1] - tw[1:, 0]
+    start = tw[1:, 0] + jitter*length*rng.uniform(size=(size, n-1))
+    orders = np.argsort(start, axis=1) + 1
+
+    rows = np.arange(size)
+    last = np.zeros((size, v), dtype=np.int64)
+    arrival = np.zeros((size, v))
+    a0 = np.zeros((size, v))
+    overtime = np.zeros((size, v))
+    routes = [[[] for k in range(v)] for r in range(size)]
+
+    for t in range(n-1):
+        i = orders[:, t]
+        empty = last == 0
+        d0i = D[0, i][:, None]
+        first = np.maximum(ss[None, :], tw[i, 0][:, None] - d0i)
+        dli = D[last, i[:, None]]
+        reach = np.where(empty, first + d0i, arrival + dli + p[last])
+        arr = np.maximum(reach, tw[i, 0][:, None])
+        start0 = np.where(empty, first, a0)
+        end = arr + D[i, 0][:, None] + p[i][:, None]
+        ot = np.maximum(0, end - (start0 + u[None, :]))
+        delta = (dli + D[i, 0][:, None] - D[last, 0] +
+                 np.maximum(0, arr - tw[i, 1][:, None]) + ot - overtime)
+        feasible = Q[i-1]
+        best = np.where(feasible, delta, np.inf).min(axis=1, keepdims=True)
+        worst = np.where(feasible, delta, -np.inf).max(axis=1, keepdims=True)
+        candidate = feasible & (delta <= best + alpha*(worst - best))
+        k = np.argmax(np.where(candidate, rng.uniform(size=(size, v)), -1),
+                      axis=1)
+        last[rows, k] = i
+        arrival[rows, k] = arr[rows, k]
+        a0[rows, k] = start0[rows, k]
+        overtime[rows, k] = ot[rows, k]
+        for r in range(size):
+            routes[r][k[r]].append(int(i[r]))
+
+    return routes
+
 # ------------------------------------------------------------------------------
 # support functions to generate planning for schedule
 # ------------------------------------------------------------------------------
@@ -137,6 +225,38 @@ def r_arrival(r, d, p, tw, ss0):
     return a
 
 
+# returns travel distance of single route r
+def r_distance(r, d):
+    return d[0][r[0]] + d[r[-1]][0] + sum([d[r[i]][r[i+1]] for i in range(len(r)-1)])
+
+
+# returns overtime + waiting time of single route r on shift k, or REJECTED
+# as soon as it reaches cutoff (same arrival times as r_arrival)
+def r_lateness(r, k, d, p, tw, u, ss, cutoff=np.inf):
+    a0 = max(ss[k], tw[r[0]][0]-d[0][r[0]])
+    a = a0
+    prev = 0
+    waiting = 0
+    for i in r:
+        a = max(a + d[prev][i] + p[prev], tw[i][0])
+        waiting += max(0, a - tw[i][1])
+        if waiting >= cutoff:
+            return REJECTED
+        prev = i
+    a = a + d[prev][0] + p[prev]
+    late = waiting + max(0, a - (a0 + u[k]))
+    if late >= cutoff:
+        return REJECTED
+    return late
+
+
+# returns score of single route r on shift k (distance + overtime + waiting time)
+def r_score(r, k, d, p, tw, u, ss):
+    if len(r) == 0:
+        return 0
+    return r_distance(r, d) + r_lateness(r, k, d, p, tw, u, ss)
+
+
 def get_arrival(route, d, p, tw, ss):
     arrival = []
     for r in route:
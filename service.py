@@ -0,0 +1,429 @@
+import itertools
+import json
+import multiprocessing as mp
+import queue
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import instance as ins_module
+import distributed
+import gomea
+
+"""
+module contains long-running solver service with a local http api
+
+main function is serve (start returns server and service without blocking):
+    starts a pool of solver processes and an http server on localhost,
+    parsed instances stay in memory keyed by content hash (in the service
+    and in every worker that solved them before), so a job only pays for
+    gomea_solve itself
+    port (integer): port of the http server
+    workers (integer): number of concurrent solves
+    queue_limit (integer): maximum number of waiting jobs
+
+api (json bodies and responses):
+    POST /instances: instance fields n, v, d, p, tw, Q, u, ss, or
+        {"region": region} for carinova_data.fetch_data -> {"key": key}
+    GET /instances: cached instances
+    POST /jobs: {"instance": key, "params": gomea specs, "seed": optional
+        integer} -> {"job": id}, 400 for params that are not gomea specs,
+        404 for an unknown instance, 503 if the queue is full
+    GET /jobs: status of all jobs
+    GET /jobs/<id>: status, progress and result of job
+    GET /jobs/<id>/stream: one json line per event (queued, started,
+        progress per generation, done/failed/cancelled) until the job ends
+    DELETE /jobs/<id>: cancels job (running jobs stop after the generation)
+
+a solver process that dies (killed, out of memory) fails its running job
+and is restarted
+
+the server binds to localhost only, it has no authentication
+"""
+
+# ------------------------------------------------------------------------------
+# solver processes
+# ------------------------------------------------------------------------------
+
+
+RESULT = ['score', 'distance', 'waiting_time', 'shift_overtime', 'gen_count',
+          'route', 'evaluations', 'progress']
+
+
+def solver(wid, inbox, events, cancel):
+    cache = {}
+    while True:
+        msg = inbox.get()
+        if msg is None:
+            return
+        job, key, instance, params, seed = msg
+        if instance is not None:
+            cache[key] = instance
+        t0 = time.time()
+
+        def callback(pop, g):
+            events.put(('progress', job, {'generation': g,
+                                          'score': float(pop.eliteScore),
+                                          'time': time.time() - t0}))
+            return cancel.value == job
+
+        events.put(('started', job, {'worker': wid}))
+        try:
+            res = gomea.gomea_solve(cache[key], callback=callback, seed=seed,
+                                   **params)
+        except Exception as e:
+            events.put(('failed', job, {'error': repr(e)}))
+        else:
+            status = 'cancelled' if cancel.value == job else 'done'
+            result = {name: res[name] for name in RESULT}
+            result['time'] = time.time() - t0
+            events.put((status, job, result))
+        events.put(('idle', job, {'worker': wid}))
+
+# ------------------------------------------------------------------------------
+# service state
+# ------------------------------------------------------------------------------
+
+
+def to_json(obj):
+    if isinstance(obj, np.integer):
+        return int(obj)
+    if isinstance(obj, np.floating):
+        return float(obj)
+    if isinstance(obj, np.ndarray):
+        return obj.tolist()
+    raise TypeError(type(obj).__name__)
+
+
+def load_instance(body):
+    if 'region' in body:
+        import carinova_data
+        data = carinova_data.fetch_data(body['region'])
+    else:
+        data = body
+    fields = [data[name] for name in ['d', 'p', 'tw', 'Q', 'u', 'ss']]
+    fields[3] = np.asarray(fields[3])
+    return ins_module.Instance(int(data['n']), int(data['v']), *fields)
+
+
+class Service:
+    def __init__(self, workers=2, queue_limit=100):
+        self.instances = {}
+        self.jobs = {}
+        self.pending = []
+        self.queue_limit = queue_limit
+        self.ids = itertools.count()
+        self.lock = threading.Condition()
+
+        self.events = mp.Queue()
+        self.inboxes = [None for w in range(workers)]
+        self.cancel = [mp.Value('q', -1) for w in range(workers)]
+        self.known = [set() for w in range(workers)]
+        self.idle = list(range(workers))
+        self.procs = [None for w in range(workers)]
+        self.dead = set()
+        self.closing = False
+        for w in range(workers):
+            self.start_solver(w)
+        threading.Thread(target=self.collect, daemon=True).start()
+
+    def start_solver(self, w):
+        self.inboxes[w] = mp.Queue()
+        self.known[w] = set()
+        self.procs[w] = mp.Process(target=solver, daemon=True,
+                                   args=(w, self.inboxes[w], self.events,
+                                         self.cancel[w]))
+        self.procs[w].start()
+
+    def add_instance(self, instance):
+        key = distributed.instance_key(instance)
+        with self.lock:
+            self.instances.setdefault(key, instance)
+        return key
+
+    def submit(self, key, params, seed=None):
+        if not isinstance(params, dict):
+            raise ValueError('params must be an object of gomea specs')
+        unknown = sorted(set(params) - set(gomea.specs))
+        if unknown:
+            raise ValueError('unknown gomea specs %s' % unknown)
+        if seed is not None and (type(seed) is not int or seed < 0):
+            raise ValueError('seed must be a nonnegative integer')
+        with self.lock:
+            if key not in self.instances:
+                raise KeyError(key)
+            if len(self.pending) >= self.queue_limit:
+                return None
+            job = next(self.ids)
+            self.jobs[job] = {'job': job, 'instance': key, 'params': params,
+                              'seed': seed, 'status': 'queued',
+                              'worker': None,
+                              'submitted': time.time(), 'events': [],
+                              'result': None}
+            self.event(job, 'queued', {})
+            self.pending.append(job)
+            self.dispatch()
+        return job
+
+    def cancel_job(self, job):
+        with self.lock:
+            record = self.jobs[job]
+            if record['status'] == 'queued':
+                self.pending.remove(job)
+                record['status'] = 'cancelled'
+                self.event(job, 'cancelled', {})
+            elif record['status'] == 'running':
+                self.cancel[record['worker']].value = job
+
+    # lock must be held: appends event to job and wakes up streams
+    def event(self, job, kind, data):
+        self.jobs[job]['events'].append(dict(data, event=kind))
+        self.lock.notify_all()
+
+    # lock must be held: hands pending jobs to idle workers (fifo), the
+    # instance is only sent to a worker that has not cached it yet
+    def dispatch(self):
+        while self.pending and self.idle:
+            job = self.pending.pop(0)
+            w = self.idle.pop(0)
+            record = self.jobs[job]
+            key = record['instance']
+            instance = None if key in self.known[w] else self.instances[key]
+            self.known[w].add(key)
+            record['status'] = 'running'
+            record['worker'] = w
+            self.cancel[w].value = -1
+            seed = record['seed']
+            if seed is None:
+                seed = np.random.randint(2**31 - 1)
+            self.inboxes[w].put((job, key, instance, record['params'], seed))
+
+    # lock must be held: a solver process that died (killed, out of memory)
+    # fails its running job and is replaced by a fresh process, one check
+    # after its death was seen so that events it posted before are collected
+    def watch(self):
+        for w, proc in enumerate(self.procs):
+            if self.closing or proc.is_alive():
+                continue
+            if w not in self.dead:
+                self.dead.add(w)
+                continue
+            self.dead.discard(w)
+            for job, record in self.jobs.items():
+                if record['status'] == 'running' and record['worker'] == w:
+                    record['status'] = 'failed'
+                    record['result'] = {'error': 'solver process exited with '
+                                        'code %s' % proc.exitcode}
+                    self.event(job, 'failed', record['result'])
+            print('restarting solver process', w)
+            self.start_solver(w)
+            if w not in self.idle:
+                self.idle.append(w)
+        self.dispatch()
+
+    def collect(self):
+        checked = time.time()
+        while True:
+            try:
+                kind, job, data = self.events.get(timeout=1)
+            except queue.Empty:
+                kind = None
+            with self.lock:
+                # progress of other workers must not delay the check
+                if kind is None or time.time() - checked > 1:
+                    self.watch()
+                    checked = time.time()
+                if kind is None:
+                    continue
+                record = self.jobs[job]
+                if kind == 'idle':
+                    if data['worker'] not in self.idle:
+                        self.idle.append(data['worker'])
+                    self.dispatch()
+                    continue
+                if record['status'] in ['done', 'cancelled', 'failed']:
+                    # late event of a job that already ended
+                    continue
+                if kind in ['done', 'cancelled', 'failed']:
+                    record['status'] = kind
+                    record['result'] = data
+                    data = {'score': data.get('score')} \
+                        if kind != 'failed' else data
+                self.event(job, kind, data)
+
+    def status(self, job, full=True):
+        record = self.jobs[job]
+        out = {name: record[name] for name in
+               ['job', 'instance', 'params', 'seed', 'status', 'worker']}
+        progress = [e for e in record['events'] if e['event'] == 'progress']
+        out['generation'] = progress[-1]['generation'] if progress else None
+        out['score'] = progress[-1]['score'] if progress else None
+        if full:
+            out['result'] = record['result']
+        return out
+
+    def stream(self, job):
+        seen = 0
+        while True:
+            with self.lock:
+                record = self.jobs[job]
+                while seen == len(record['events']):
+                    self.lock.wait()
+                events = record['events'][seen:]
+                seen = len(record['events'])
+            for e in events:
+                yield e
+                if e['event'] in ['done', 'cancelled', 'failed']:
+                    return
+
+    def close(self):
+        self.closing = True
+        for inbox in self.inboxes:
+            inbox.put(None)
+        for proc in self.procs:
+            proc.join(timeout=1)
+            if proc.is_alive():
+                proc.terminate()
+
+# ------------------------------------------------------------------------------
+# http api
+# ------------------------------------------------------------------------------
+
+
+class Handler(BaseHTTPRequestHandler):
+    service = None
+
+    def reply(self, code, obj):
+        data = json.dumps(obj, default=to_json).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def body(self):
+        length = int(self.headers.get('Content-Length', 0))
+        return json.loads(self.rfile.read(length) or b'{}')
+
+    def job_id(self, part):
+        try:
+            job = int(part)
+        except ValueError:
+            return None
+        return job if job in self.service.jobs else None
+
+    def do_POST(self):
+        try:
+            body = self.body()
+        except ValueError as e:
+            return self.reply(400, {'error': str(e)})
+        if self.path == '/instances':
+            try:
+                instance = load_instance(body)
+            except (KeyError, ValueError, TypeError, OSError) as e:
+                return self.reply(400, {'error': repr(e)})
+            key = self.service.add_instance(instance)
+            return self.reply(200, {'key': key, 'n': instance.n,
+                                    'v': instance.v})
+        if self.path == '/jobs':
+            try:
+                job = self.service.submit(body.get('instance'),
+                                          body.get('params', {}),
+                                          body.get('seed'))
+            except KeyError:
+                return self.reply(404, {'error': 'unknown instance'})
+            except ValueError as e:
+                return self.reply(400, {'error': str(e)})
+            if job is None:
+                return self.reply(503, {'error': 'queue is full'})
+            return self.reply(200, {'job': job})
+        self.reply(404, {'error': 'not found'})
+
+    def do_GET(self):
+        parts = self.path.strip('/').split('/')
+        if parts == ['instances']:
+            return self.reply(200, [{'key': key, 'n': ins.n, 'v': ins.v}
+                                    for key, ins in
+                                    list(self.service.instances.items())])
+        if parts == ['jobs']:
+            return self.reply(200, [self.service.status(job, full=False)
+                                    for job in list(self.service.jobs)])
+        if len(parts) >= 2 and parts[0] == 'jobs':
+            job = self.job_id(parts[1])
+            if job is None:
+                return self.reply(404, {'error': 'unknown job'})
+            if len(parts) == 2:
+                return self.reply(200, self.service.status(job))
+            if parts[2:] == ['stream']:
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/x-ndjson')
+                self.end_headers()
+                for e in self.service.stream(job):
+                    self.wfile.write((json.dumps(e, default=to_json) +
+                                      '\n').encode())
+                    self.wfile.flush()
+                return
+        self.reply(404, {'error': 'not found'})
+
+    def do_DELETE(self):
+        parts = self.path.strip('/').split('/')
+        job = self.job_id(parts[1]) if len(parts) == 2 and \
+            parts[0] == 'jobs' else None
+        if job is None:
+            return self.reply(404, {'error': 'unknown job'})
+        self.service.cancel_job(job)
+        self.reply(200, self.service.status(job, full=False))
+
+    def log_message(self, format, *args):
+        pass
+
+# ------------------------------------------------------------------------------
+# main function
+# ------------------------------------------------------------------------------
+
+
+def start(port=8765, workers=2, queue_limit=100):
+    service = Service(workers, queue_limit)
+    handler = type('ServiceHandler', (Handler,), {'service': service})
+    server = ThreadingHTTPServer(('localhost', port), handler)
+    server.daemon_threads = True
+    print('solver service on http://localhost:%d with %d workers' %
+          (server.server_address[1], workers))
+    return server, service
+
+
+def serve(port=8765, workers=2, queue_limit=100):
+    server, service = start(port, workers, queue_limit)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        service.close()
+
+
+# minimal client: json request to the service, returns decoded response
+def call(url, method='GET', body=None):
+    data = None if body is None else json.dumps(body, default=to_json).encode()
+    request = urllib.request.Request(url, data=data, method=method,
+                                     headers={'Content-Type':
+                                              'application/json'})
+    with urllib.request.urlopen(request) as response:
+        return json.loads(response.read())
+
+
+if __name__ == "__main__":
+    ins = ins_module.Instance(30, 4)
+    server, service = start(0, 2)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://localhost:%d' % server.server_address[1]
+    key = call(url + '/instances', 'POST', ins.__dict__)['key']
+    jobs = [call(url + '/jobs', 'POST', {'instance': key,
+                                         'params': {'generations': 3}})['job']
+            for j in range(3)]
+    with urllib.request.urlopen(url + '/jobs/%d/stream' % jobs[-1]) as lines:
+        for line in lines:
+            print(line.decode().strip())
+    print(call(url + '/jobs'))
+    server.shutdown()
+    service.close()
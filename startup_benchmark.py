@@ -0,0 +1,56 @@
+import os.path
+import subprocess
+import sys
+
+'''
+startup benchmark: import time of each module in a fresh interpreter and
+the heavy dependencies it pulls in
+
+the solver core (instance, schedule, measures, gomea) must import without
+routing, excel or scipy modules, main returns 1 if it does not
+'''
+
+CORE = ['instance', 'schedule', 'measures', 'gomea']
+OTHER = ['islands', 'decomposition', 'distributed', 'service', 'portfolio',
+         'tuning', 'carinova_data', 'travel_matrix', 'road_graph']
+HEAVY = ['scipy', 'pandas', 'osmnx', 'networkx', 'requests', 'matplotlib']
+
+PROBE = '''
+import sys, time
+t = time.perf_counter()
+import {module}
+t = time.perf_counter() - t
+heavy = [m for m in {heavy} if m in sys.modules]
+print(t, ','.join(heavy))
+'''
+
+
+def import_time(module, repeat=3):
+    directory = os.path.dirname(os.path.abspath(__file__))
+    best, heavy = None, ''
+    for r in range(repeat):
+        out = subprocess.run([sys.executable, '-c',
+                              PROBE.format(module=module, heavy=HEAVY)],
+                             cwd=directory, capture_output=True, text=True,
+                             check=True).stdout.split()
+        t = float(out[0])
+        heavy = out[1] if len(out) > 1 else ''
+        best = t if best is None else min(best, t)
+    return best, heavy
+
+
+def main():
+    failed = False
+    print('%-16s %10s  %s' % ('module', 'import [s]', 'heavy dependencies'))
+    for module in CORE + OTHER:
+        t, heavy = import_time(module)
+        print('%-16s %10.4f  %s' % (module, t, heavy or '-'))
+        if module in CORE and heavy:
+            failed = True
+    if failed:
+        print('solver core imports heavy dependencies')
+    return int(failed)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,7 +1,4 @@
-import requests
 import numpy as np
-import osmnx
-import networkx
 
 
 '''
@@ -12,6 +9,17 @@ based on two possible websites
 2) (http://project-osrm.org/)
 
 main function is travel_matrix
+
+estimate_matrix builds a matrix of the same layout without routing queries:
+haversine distance times a detour factor, fitted per region with
+fit_detour against an exact matrix of that region (fit error is reported)
+
+requests, osmnx and networkx are imported only by the functions that query
+a router or road graph
+
+with engine='csr' the graphml file at path (or a directory converted before)
+is used in the compact array format of road_graph (converted once), which
+replaces osmnx and the per-pair networkx queries
 '''
 
 # splits list in batches of size 50 one batch with remaining elements
@@ -67,11 +75,21 @@ main function is travel_matrix
 # alternative to above method is OSRM API implemented below (http://project-osrm.org/)
 
 
-def travel_matrix(size, lat, lon, path, silent=True):
+def travel_matrix(size, lat, lon, path, silent=True, engine='osmnx'):
     print('computing travel times...')
+    if path and engine == 'csr':
+        import os.path
+        import road_graph
+        if not os.path.isdir(path):
+            path = road_graph.cached(path)
+        print('using csr road graph')
+        d = road_graph.travel_matrix(size, lat, lon, path, silent)
+        print('computation finished')
+        return d
     f = 'using osrm'
     path = path
     if path:
+        import osmnx
         graph = osmnx.load_graphml(path)
         f = 'using osmnx'
     print(f)
@@ -103,6 +121,7 @@ def travel_matrix(size, lat, lon, path, silent=True):
 
 
 def traveltime_osrm(lat1, lat2, lon1, lon2):
+    import requests
     coordinates = str(lon1)+','+str(lat1)+';'+str(lon2)+','+str(lat2)
     url = 'http://router.project-osrm.org/route/v1/driving/'+coordinates
     response = requests.get(url)
@@ -117,6 +136,8 @@ def traveltime_osrm(lat1, lat2, lon1, lon2):
 
 
 def traveltime_osmnx(lat1, lat2, lon1, lon2, graph):
+    import osmnx
+    import networkx
     # Get node IDs of nearest nodes
     node_list = osmnx.distance.nearest_nodes(
         G=graph,
@@ -137,3 +158,48 @@ def matrix_dev(distanceMatrix1, distanceMatrix2):
     F = M1/M2
     norm = np.linalg.norm(D)
     return M1, M2, D, F, norm
+
+
+# ------------------------------------------------------------------------------
+# estimated travel matrices (no routing)
+# ------------------------------------------------------------------------------
+
+EARTH_RADIUS = 6371008.8
+
+
+# returns great circle distances in meters between all coordinates
+def haversine_matrix(lat, lon):
+    lat = np.radians(np.asarray(lat, dtype=np.float64))
+    lon = np.radians(np.asarray(lon, dtype=np.float64))
+    dlat = lat[:, None] - lat[None, :]
+    dlon = lon[:, None] - lon[None, :]
+    h = (np.sin(dlat/2)**2 +
+         np.cos(lat)[:, None]*np.cos(lat)[None, :]*np.sin(dlon/2)**2)
+    return 2*EARTH_RADIUS*np.arcsin(np.sqrt(np.clip(h, 0, 1)))
+
+
+# least squares detour factor of exact matrix (layout of travel_matrix) over
+# haversine distances, returns factor and fit error on the client pairs
+def fit_detour(lat, lon, exact, silent=False):
+    H = haversine_matrix(lat, lon)
+    M = np.asarray(exact, dtype=np.float64)[1:, 1:]
+    pairs = ~np.eye(len(H), dtype=bool) & (H > 0)
+    h, m = H[pairs], M[pairs]
+    factor = np.dot(h, m)/np.dot(h, h)
+    residual = factor*h - m
+    error = {'pairs': int(pairs.sum()),
+             'rmse': float(np.sqrt(np.mean(residual**2))),
+             'mae': float(np.mean(np.abs(residual))),
+             'mape': float(np.mean(np.abs(residual)/np.maximum(m, 1e-9))),
+             'max': float(np.max(np.abs(residual)))}
+    if not silent:
+        print('detour factor %.4f, rmse %.1f, mean relative error %.2f%%' %
+              (factor, error['rmse'], 100*error['mape']))
+    return factor, error
+
+
+# same layout as travel_matrix: row and column 0 are zero
+def estimate_matrix(size, lat, lon, factor):
+    d = np.zeros((size+1, size+1))
+    d[1:, 1:] = factor*haversine_matrix(lat, lon)[:size, :size]
+    return d.tolist()
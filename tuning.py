@@ -0,0 +1,161 @@
+import concurrent.futures
+import csv
+import itertools
+import time
+import datetime
+import numpy as np
+import gomea
+
+"""
+module contains parameter tuning harness for gomea specs
+
+main function is tune:
+    successive halving per instance class over configurations of gomea specs
+    (population, noimprove, stop, deptype, ...), with generations as the
+    resource that grows every round
+    instances (list of (class, instance)): training instances, configurations
+        are ranked per class
+    space (dict): spec name -> list of values, default is SPACE
+    samples (integer or None): number of random configurations drawn from
+        space (None: full grid)
+    min_generations (integer): generations per solve in the first round
+    eta (integer): factor by which configurations are cut and generations
+        grow every round
+    budget (float or None): total solve seconds (summed over processes),
+        no new round starts once it is spent
+    workers (integer or None): number of processes (None: number of cores)
+    report (path or None): csv file of all evaluations
+    returns dictionary with recommended specs per class and the report rows
+
+quality of a solve is its score relative to the best score found for that
+instance in the same round (1 is best), configurations are ranked on mean
+quality, ties on mean time
+"""
+
+SPACE = {'population': [50, 100, 200],
+         'noimprove': [None, 2, 5],
+         'stop': [5, 10],
+         'deptype': [1, 2, 3]}
+
+# ------------------------------------------------------------------------------
+# evaluation
+# ------------------------------------------------------------------------------
+
+
+def configurations(space, samples=None):
+    names = sorted(space)
+    grid = [dict(zip(names, values))
+            for values in itertools.product(*[space[s] for s in names])]
+    if samples is not None and samples < len(grid):
+        pick = np.random.choice(len(grid), samples, replace=False)
+        grid = [grid[i] for i in sorted(pick)]
+    return grid
+
+
+def run_config(instance, params, seed):
+    t0 = time.process_time()
+    res = gomea.gomea_solve(instance, seed=seed, **params)
+    return res['score'], time.process_time() - t0, res['gen_count']
+
+
+def evaluate(pool, instances, configs, generations):
+    jobs = {}
+    for c, config in enumerate(configs):
+        for i, ins in enumerate(instances):
+            params = dict(config, generations=generations)
+            jobs[pool.submit(run_config, ins, params,
+                             np.random.randint(2**31 - 1))] = (c, i)
+    score = np.zeros((len(configs), len(instances)))
+    cost = np.zeros((len(configs), len(instances)))
+    for future in concurrent.futures.as_completed(jobs):
+        c, i = jobs[future]
+        score[c, i], cost[c, i], g = future.result()
+    return score, cost
+
+# ------------------------------------------------------------------------------
+# successive halving
+# ------------------------------------------------------------------------------
+
+
+def halving(pool, label, instances, configs, min_generations, eta, budget,
+            spent, rows):
+    alive = list(range(len(configs)))
+    generations = min_generations
+    r = 0
+    while True:
+        score, cost = evaluate(pool, instances,
+                               [configs[c] for c in alive], generations)
+        spent += cost.sum()
+        quality = score.min(axis=0)/np.maximum(score, 1e-9)
+        mean_q = quality.mean(axis=1)
+        mean_t = cost.mean(axis=1)
+        for a, c in enumerate(alive):
+            rows.append({'class': label, 'round': r,
+                         'generations': generations, 'config': configs[c],
+                         'quality': mean_q[a], 'time': mean_t[a],
+                         'score': score[a].mean()})
+        order = np.lexsort((mean_t, -mean_q))
+        keep = max(1, len(alive)//eta)
+        alive = [alive[a] for a in order[:keep]]
+        r += 1
+        if len(alive) == 1 or (budget is not None and spent >= budget):
+            return alive[0], generations, spent
+        generations *= eta
+
+# ------------------------------------------------------------------------------
+# main function
+# ------------------------------------------------------------------------------
+
+
+def tune(instances, space=SPACE, samples=None, min_generations=2, eta=3,
+         budget=None, workers=None, report=None):
+    t0 = time.time()
+    configs = configurations(space, samples)
+    classes = {}
+    for label, ins in instances:
+        classes.setdefault(label, []).append(ins)
+
+    rows = []
+    spent = 0
+    recommended = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+        for label, members in classes.items():
+            best, generations, spent = halving(pool, label, members, configs,
+                                               min_generations, eta, budget,
+                                               spent, rows)
+            recommended[label] = dict(gomea.specs, **configs[best])
+            recommended[label]['generations'] = generations
+            print('class', label, 'recommended:', configs[best],
+                  'generations:', generations)
+    t1 = time.time()
+    print('tuning finished in', str(datetime.timedelta(seconds=t1-t0)),
+          'solve time %.1f s' % spent)
+
+    if report is not None:
+        with open(report, 'w', newline='') as file:
+            writer = csv.writer(file)
+            names = sorted(space)
+            writer.writerow(['class', 'round', 'generations'] + names +
+                            ['quality', 'time', 'score'])
+            for row in rows:
+                writer.writerow([row['class'], row['round'], row['generations']] +
+                                [row['config'][s] for s in names] +
+                                ['%.4f' % row['quality'], '%.3f' % row['time'],
+                                 '%.1f' % row['score']])
+
+    result = {}
+    result['recommended'] = recommended
+    result['report'] = rows
+    result['solve_time'] = spent
+    result['wall_time'] = t1 - t0
+    return result
+
+
+if __name__ == "__main__":
+    import instance
+    train = [('small', instance.Instance(20, 3)),
+             ('small', instance.Instance(20, 3)),
+             ('medium', instance.Instance(40, 5))]
+    res = tune(train, space={'population': [50, 100], 'deptype': [1, 2, 3]},
+               min_generations=1, eta=2, report='tuning_report.csv')
+    print(res['recommended'])